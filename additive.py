@@ -0,0 +1,143 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils import DTYPE
+from wavetable import TABLE_SIZE, waveform_partials
+
+# Additive synthesis in the frequency domain (inverse FFT synthesis): every frame, each partial is written
+# into a few spectrum bins as the spectrum of a Blackman-Harris windowed sinusoid, then one inverse rfft
+# gives all the partials at once. The window is divided out and frames centered at multiples of the hop
+# are overlap-added with triangles. The cost per frame is one FFT plus a few bins per partial, so hundreds
+# of partials cost about as much as a handful.
+
+FRAME_SIZE = 512  # Samples of one inverse FFT, a frame contributes to its central half
+KERNEL_WIDTH = 4  # Bins on each side of a partial, the main lobe of the Blackman-Harris window
+KERNEL_OVERSAMPLING = 256  # Kernel table points per bin
+FRAMES_PER_CHUNK = 64  # Frames synthesized together, bounds the memory of long renders
+_BLACKMAN_HARRIS = (0.35875, 0.48829, 0.14128, 0.01168)
+
+
+def blackman_harris(size: int) -> np.ndarray:
+    '''
+    Periodic 4-term Blackman-Harris window, peak at size // 2.
+    '''
+    phase = 2 * np.pi * np.arange(size) / size
+    a0, a1, a2, a3 = _BLACKMAN_HARRIS
+    return a0 - a1 * np.cos(phase) + a2 * np.cos(2 * phase) - a3 * np.cos(3 * phase)
+
+def _kernel_table(size: int) -> np.ndarray:
+    '''
+    Spectrum of the window centered on sample 0, which is real and even, sampled every
+    1 / KERNEL_OVERSAMPLING bin from -KERNEL_WIDTH - 1 to KERNEL_WIDTH + 1 bins.
+    '''
+    # Zero-padded with the negative time half at the end, so that the window stays centered on 0
+    padded = np.zeros(size * KERNEL_OVERSAMPLING)
+    padded[:size] = blackman_harris(size)
+    spectrum = np.fft.fft(np.roll(padded, -(size // 2))).real
+    half = (KERNEL_WIDTH + 1) * KERNEL_OVERSAMPLING
+    return np.concatenate((spectrum[-half:], spectrum[:half + 1]))
+
+_kernels = {}
+
+def _kernel(offsets: np.ndarray, size: int) -> np.ndarray:
+    '''
+    Window spectrum at fractional bin offsets, linearly interpolated in the table.
+    '''
+    if size not in _kernels:
+        _kernels[size] = _kernel_table(size)
+    table = _kernels[size]
+    position = (offsets + KERNEL_WIDTH + 1) * KERNEL_OVERSAMPLING
+    index = np.clip(position.astype(int), 0, len(table) - 2)
+    fraction = position - index
+    return table[index] + fraction * (table[index + 1] - table[index])
+
+def render_additive(
+    frequencies: np.ndarray,
+    frames: int,
+    sample_rate: int = 44100,
+    initial_phases: Optional[np.ndarray] = None,
+    waveform: str = "sinus",
+    harmonics: List[float] = [1.0],
+    frame_size: int = FRAME_SIZE
+) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Inverse FFT counterpart of the oscillator in synthesis.generate_tone, same shapes and phase contract.
+    frequencies has shape (voices,) and initial_phases (voices, harmonics). For the sinus waveform each
+    harmonic starts at its own phase; the other waveforms are sums of their band-limited partials,
+    phase-locked to the fundamental which starts at initial_phases[:, 0].
+    Frames only depend on the phases at their center, so a block can be rendered on its own.
+    Returns the (voices, frames) signal and the final phase of each harmonic.
+    '''
+    frequencies = np.asarray(frequencies, dtype=float)
+    num_voices = len(frequencies)
+    if initial_phases is None:
+        initial_phases = np.zeros((num_voices, len(harmonics)))
+    initial_phases = np.asarray(initial_phases, dtype=float)
+
+    # Partials of every voice, shape (voices, partials)
+    if waveform == "sinus":
+        amplitudes = np.broadcast_to(np.asarray(harmonics, dtype=float), initial_phases.shape)
+        orders = np.arange(1, initial_phases.shape[1] + 1)
+        phases = initial_phases
+    else:
+        top = int(sample_rate / 2 / max(np.min(frequencies), 1.0)) if num_voices > 0 else 1
+        amplitudes = waveform_partials(waveform, harmonics, min(max(top, 1), TABLE_SIZE // 2 - 1))[None, :]
+        orders = np.arange(1, amplitudes.shape[1] + 1)
+        phases = initial_phases[:, :1] * orders
+    partial_frequencies = frequencies[:, None] * orders
+    bins = partial_frequencies * frame_size / sample_rate
+    # Partials whose kernel would cross Nyquist are left out, as they would alias
+    amplitudes = np.where(bins < frame_size // 2 - KERNEL_WIDTH, amplitudes, 0.0)
+    voice, partial = np.nonzero(amplitudes)
+    bins = bins[voice, partial]
+    # sin(x) = cos(x - pi / 2), the spectrum below is the one of cosines
+    start_phases = phases[voice, partial] - np.pi / 2
+    steps = 2 * np.pi * partial_frequencies[voice, partial] / sample_rate
+    halves = amplitudes[voice, partial] / 2
+
+    # Bins touched by each partial and the kernel values, the same for every frame
+    offsets = np.floor(bins)[:, None] + np.arange(-KERNEL_WIDTH + 1, KERNEL_WIDTH + 1)
+    kernel = _kernel(offsets - bins[:, None], frame_size) * halves[:, None]
+    # The negative frequency image of a partial near DC folds onto the positive bins, conjugated,
+    # and irfft only keeps the real part of the DC bin, which both images share
+    folded = offsets < 0
+    kernel[offsets == 0] *= 2
+    targets = voice[:, None] * (frame_size // 2 + 1) + np.abs(offsets).astype(int)
+
+    hop = frame_size // 4
+    num_frames = -(-frames // hop) + 1  # Frames centered on 0, hop, ... up to the end of the block
+    # Overlap-add buffer in blocks of hop samples, block 0 starts hop samples before the signal
+    # Phases and FFTs are in float64, frames are cast when they are added to it
+    output = np.zeros((num_voices, num_frames + 1, hop), dtype=DTYPE)
+    # Triangle over the central half of a frame, divided by the window the kernel put there
+    taper = np.concatenate((np.arange(hop), hop - np.arange(hop))) / hop
+    gain = taper / blackman_harris(frame_size)[frame_size // 2 - hop:frame_size // 2 + hop]
+
+    for first in range(0, num_frames, FRAMES_PER_CHUNK):
+        centers = np.arange(first, min(first + FRAMES_PER_CHUNK, num_frames)) * hop
+        # Phase of each partial at the center of each frame, shape (frames, partials)
+        frame_phases = start_phases + np.multiply.outer(centers, steps)
+        values = np.exp(1j * frame_phases)[:, :, None] * kernel
+        values = np.where(folded, np.conj(values), values)
+
+        size = num_voices * (frame_size // 2 + 1)
+        index = (np.arange(len(centers))[:, None, None] * size + targets).ravel()
+        spectrum = (
+            np.bincount(index, values.real.ravel(), len(centers) * size)
+            + 1j * np.bincount(index, values.imag.ravel(), len(centers) * size)
+        ).reshape(len(centers), num_voices, frame_size // 2 + 1)
+
+        # Sample 0 of a frame is its center, its central half is [-hop, hop)
+        frame = np.fft.irfft(spectrum, frame_size, axis=-1)
+        segment = np.concatenate((frame[..., -hop:], frame[..., :hop]), axis=-1) * gain
+        blocks = np.arange(first, first + len(centers))
+        output[:, blocks] += segment[:, :, :hop].transpose(1, 0, 2)
+        output[:, blocks + 1] += segment[:, :, hop:].transpose(1, 0, 2)
+
+    signal = output.reshape(num_voices, -1)[:, hop:hop + frames]
+
+    # Same phase bookkeeping as the direct oscillator
+    omega = 2 * np.pi * frequencies[:, None] * np.arange(1, initial_phases.shape[1] + 1)
+    final_phases = (omega * frames / sample_rate + initial_phases) % (2 * np.pi)
+    return signal, final_phases
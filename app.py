@@ -1,7 +1,11 @@
 import sys
+
+import sounddevice as sd
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QSlider, QCheckBox, QLabel, QPushButton
 
+import parameters as p
 import utils
+from engine import OscillatorEngine
 from oscillator import Oscillator
 
 class UserInterface(QWidget):
@@ -40,5 +44,26 @@ if __name__ == '__main__':
         Oscillator(utils.NOTE_FREQUENCIES["E3"], label="Oscillator1"),
         Oscillator(utils.NOTE_FREQUENCIES["G3"], label="Oscillator1"),
     ]
+
+    # The audio thread renders the last published snapshot, the GUI never waits for it
+    engine = OscillatorEngine([oscillator.state() for oscillator in lOscillators])
+
+    def publish():
+        engine.publish([oscillator.state() for oscillator in lOscillators])
+    for oscillator in lOscillators:
+        oscillator.onChange = publish
+
+    def audio_callback(outdata, frames, time, status):
+        engine.render_into(outdata[:, 0])
+
+    stream = sd.OutputStream(
+        samplerate=utils.SAMPLE_RATE,
+        channels=1,
+        dtype=utils.DTYPE.name,
+        callback=audio_callback,
+        blocksize=p.LATENCY_PROFILES["balanced"]["blocksize"],
+    )
     ex = UserInterface(lOscillators=lOscillators)
-    sys.exit(app.exec_())
+    with stream:
+        status = app.exec_()
+    sys.exit(status)
@@ -0,0 +1,43 @@
+'''
+Compares the direct, wavetable and inverse FFT oscillators on sinus patches with many harmonics:
+time to render one block and largest difference with the direct sum of sines.
+Run from the repository root: python -m benchmarks.additive
+'''
+import argparse
+import timeit
+
+import numpy as np
+
+from synthesis import generate_tone
+from utils import SAMPLE_RATE
+
+NUM_HARMONICS = [8, 32, 128, 256, 512]
+BACKENDS = ["direct", "wavetable", "ifft"]
+
+
+def render(backend, frequency, frames, harmonics):
+    signal, _ = generate_tone(
+        frequency, frames / SAMPLE_RATE, sample_rate=SAMPLE_RATE, harmonics=harmonics, backend=backend, normalize=False
+    )
+    return signal
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frequency", type=float, default=40.0, help="Fundamental frequency in Hz")
+    parser.add_argument("--blocksize", type=int, default=2205, help="Frames per rendered block")
+    parser.add_argument("--repeat", type=int, default=20, help="Blocks rendered per measure")
+    args = parser.parse_args()
+
+    for num_harmonics in NUM_HARMONICS:
+        # Harmonics above Nyquist would alias in the direct sum, they are left out
+        num_harmonics = min(num_harmonics, int(SAMPLE_RATE / 2 / args.frequency) - 1)
+        harmonics = list(1 / np.arange(1, num_harmonics + 1))
+        reference = render("direct", args.frequency, args.blocksize, harmonics)
+        print(f"{num_harmonics} harmonics")
+        for backend in BACKENDS:
+            # Rendered once before timing, which also builds the tables of the wavetable and ifft backends
+            error = np.max(np.abs(render(backend, args.frequency, args.blocksize, harmonics) - reference))
+            seconds = timeit.timeit(
+                lambda: render(backend, args.frequency, args.blocksize, harmonics), number=args.repeat
+            )
+            print(f"  {backend:<10} {1e3 * seconds / args.repeat:8.3f} ms/block   max error {error:.1e}")
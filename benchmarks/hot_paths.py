@@ -0,0 +1,191 @@
+'''
+Samples per second and time per block of the synthesis hot paths, for block sizes from 64 to 4096,
+with the share of the callback deadline (blocksize / sample rate) each one uses.
+Results are written as JSON so that two runs (e.g. two commits) can be compared.
+Run from the repository root:
+    python -m benchmarks.hot_paths -o before.json
+    python -m benchmarks.hot_paths -o after.json
+    python -m benchmarks.hot_paths --compare before.json after.json
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+import parameters as p
+from envelope import ADSREnvelope
+from graph import AudioGraph, VoicePoolNode
+from synthesis import apply_chorus_effect, generate_envelope, generate_tone
+from utils import DTYPE, SAMPLE_RATE
+from voices import VoicePool
+
+BLOCKSIZES = [64, 128, 256, 512, 1024, 2048, 4096]
+WAVEFORMS = ["sinus", "sawtooth", "square", "triangle"]
+NUM_HARMONICS = [1, 2, 4, 8, 16]
+POLYPHONY = [1, 8, 32]
+FREQUENCY = 440.0
+
+
+def tone_case(waveform: str, num_harmonics: int) -> Callable[[int], Callable[[], None]]:
+    harmonics = list(0.5 ** np.arange(num_harmonics))
+
+    def setup(blocksize):
+        duration = blocksize / SAMPLE_RATE
+        return lambda: generate_tone(FREQUENCY, duration, waveform=waveform, harmonics=harmonics)
+    return setup
+
+def envelope_case(blocksize: int) -> Callable[[], None]:
+    duration = blocksize / SAMPLE_RATE
+    return lambda: generate_envelope(duration, duration / 4, duration / 4)
+
+def chorus_case(blocksize: int) -> Callable[[], None]:
+    signal, _ = generate_tone(FREQUENCY, blocksize / SAMPLE_RATE)
+    return lambda: apply_chorus_effect(signal)
+
+def callback_case(polyphony: int) -> Callable[[int], Callable[[], None]]:
+    '''
+    Same work as custom_keyboard.audio_callback without a stream: the graph of the keyboard
+    renders the voice pool into an outdata block of the stream sample type.
+    '''
+    def setup(blocksize):
+        envelope = ADSREnvelope(p.ATTACK, p.DECAY, p.SUSTAIN, p.RELEASE, sample_rate=SAMPLE_RATE)
+        pool = VoicePool(size=max(polyphony, p.POLYPHONY), envelope=envelope, sample_rate=SAMPLE_RATE)
+        engine = AudioGraph(VoicePoolNode(pool))
+        engine.prepare(blocksize)
+        outdata = np.zeros((blocksize, 1), dtype=DTYPE)
+
+        def callback():
+            # Notes are held so that the number of voices stays constant
+            if pool.active < polyphony:
+                for i in range(pool.active, polyphony):
+                    pool.note_on(FREQUENCY * 2 ** (i / 12))
+            engine.render_into(outdata[:, 0])
+        return callback
+    return setup
+
+def cases() -> Iterator[Tuple[str, Callable[[int], Callable[[], None]]]]:
+    for waveform in WAVEFORMS:
+        for num_harmonics in NUM_HARMONICS:
+            yield f"generate_tone[{waveform},h={num_harmonics}]", tone_case(waveform, num_harmonics)
+    yield "generate_envelope", envelope_case
+    yield "apply_chorus_effect", chorus_case
+    for polyphony in POLYPHONY:
+        yield f"audio_callback[voices={polyphony}]", callback_case(polyphony)
+
+def measure(function: Callable[[], None], min_time: float, repeat: int) -> float:
+    '''
+    Median time of one call in seconds, over repeat measures of at least min_time each.
+    '''
+    function()  # Warm-up, caches and lazy allocations
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+    return float(np.median(timings))
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run(blocksizes: List[int], min_time: float = 0.05, repeat: int = 5, pattern: str = "") -> Dict:
+    results = []
+    for name, setup in cases():
+        if pattern not in name:
+            continue
+        for blocksize in blocksizes:
+            seconds = measure(setup(blocksize), min_time, repeat)
+            deadline = blocksize / SAMPLE_RATE
+            result = {
+                "name": name,
+                "blocksize": blocksize,
+                "seconds_per_block": seconds,
+                "samples_per_second": blocksize / seconds,
+                "deadline_percent": 100 * seconds / deadline,
+            }
+            results.append(result)
+            print(
+                f"{name:<36} {blocksize:>5} {1e6 * seconds:10.1f} us/block "
+                f"{result['samples_per_second'] / 1e6:8.2f} Msamples/s {result['deadline_percent']:7.2f} % of deadline"
+            )
+    return {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "sample_rate": SAMPLE_RATE,
+        "results": results,
+    }
+
+def compare(baseline: Dict, current: Dict, threshold: float = 10.0) -> List[Dict]:
+    '''
+    Prints the change of time per block of the cases measured in both runs.
+    Returns the regressions, cases slower than the baseline by more than threshold percent.
+    '''
+    reference = {(r["name"], r["blocksize"]): r["seconds_per_block"] for r in baseline["results"]}
+    print(f"Baseline {baseline['commit']} ({baseline['date']}), current {current['commit']} ({current['date']})")
+    regressions = []
+    for result in current["results"]:
+        key = (result["name"], result["blocksize"])
+        if key not in reference:
+            continue
+        change = 100 * (result["seconds_per_block"] / reference[key] - 1)
+        flag = ""
+        if change > threshold:
+            flag = "REGRESSION"
+            regressions.append(dict(result, change_percent=change))
+        print(f"{key[0]:<36} {key[1]:>5} {change:+8.1f} % {flag}")
+    print(f"{len(regressions)} regression(s) above {threshold:g} %")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    parser.add_argument(
+        "--blocksizes",
+        default=",".join(map(str, BLOCKSIZES)),
+        help="Comma-separated block sizes in frames"
+    )
+    parser.add_argument("--filter", default="", help="Only run the cases whose name contains this string")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum duration of one measure in seconds")
+    parser.add_argument("--repeat", type=int, default=5, help="Measures per case, the median is kept")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="Compare two result files instead of running the benchmarks"
+    )
+    parser.add_argument("--threshold", type=float, default=10.0, help="Slowdown in percent flagged as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path) as fp:
+                runs.append(json.load(fp))
+        # Non-zero exit status on regression, so that it can gate a script or a CI job
+        sys.exit(1 if compare(*runs, threshold=args.threshold) else 0)
+
+    report = run([int(b) for b in args.blocksizes.split(",")], args.min_time, args.repeat, args.filter)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
@@ -0,0 +1,65 @@
+'''
+Compares the naive, PolyBLEP and 4x-oversampled sawtooth / square / triangle oscillators:
+time to render one block and level of the aliased partials.
+Run from the repository root: python -m benchmarks.polyblep
+'''
+import argparse
+import timeit
+
+import numpy as np
+
+from synthesis import generate_tone
+from utils import SAMPLE_RATE
+
+OVERSAMPLING = 4
+# Windowed-sinc low-pass at the original Nyquist, used to decimate the oversampled signal
+_TAPS = 64 * OVERSAMPLING + 1
+_n = np.arange(_TAPS) - _TAPS // 2
+DECIMATION_FILTER = np.sinc(_n / OVERSAMPLING) / OVERSAMPLING * np.blackman(_TAPS)
+
+
+def render_naive(frequency, frames, waveform):
+    signal, _ = generate_tone(frequency, frames / SAMPLE_RATE, sample_rate=SAMPLE_RATE, waveform=waveform, normalize=False)
+    return signal
+
+def render_polyblep(frequency, frames, waveform):
+    signal, _ = generate_tone(
+        frequency, frames / SAMPLE_RATE, sample_rate=SAMPLE_RATE, waveform=waveform, backend="polyblep", normalize=False
+    )
+    return signal
+
+def render_oversampled(frequency, frames, waveform):
+    rate = SAMPLE_RATE * OVERSAMPLING
+    signal, _ = generate_tone(frequency, frames / SAMPLE_RATE, sample_rate=rate, waveform=waveform, normalize=False)
+    return np.convolve(signal, DECIMATION_FILTER, mode="same")[::OVERSAMPLING]
+
+def alias_level(signal, frequency):
+    '''
+    Energy outside of the harmonics of frequency, relative to the energy of the harmonics (in dB).
+    '''
+    spectrum = np.abs(np.fft.rfft(signal * np.hanning(len(signal)))) ** 2
+    bins = np.fft.rfftfreq(len(signal), d=1 / SAMPLE_RATE)
+    resolution = bins[1]
+    distance = np.abs(bins / frequency - np.round(bins / frequency)) * frequency
+    harmonic = (distance <= 3 * resolution) & (bins > frequency / 2)
+    return 10 * np.log10(spectrum[~harmonic].sum() / spectrum[harmonic].sum())
+
+RENDERERS = {
+    "naive": render_naive,
+    "polyblep": render_polyblep,
+    f"oversampled x{OVERSAMPLING}": render_oversampled,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frequency", type=float, default=2937.0, help="Fundamental frequency in Hz")
+    parser.add_argument("--blocksize", type=int, default=2205, help="Frames per rendered block")
+    parser.add_argument("--repeat", type=int, default=50, help="Blocks rendered per measure")
+    args = parser.parse_args()
+
+    for waveform in ("sawtooth", "square", "triangle"):
+        print(waveform)
+        for name, render in RENDERERS.items():
+            seconds = timeit.timeit(lambda: render(args.frequency, args.blocksize, waveform), number=args.repeat)
+            aliasing = alias_level(render(args.frequency, SAMPLE_RATE, waveform), args.frequency)
+            print(f"  {name:<16} {1e3 * seconds / args.repeat:8.3f} ms/block   aliasing {aliasing:6.1f} dB")
@@ -0,0 +1,188 @@
+import json
+import os
+import queue
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils import SAMPLE_RATE
+
+# Samples are stored as raw float32 in a .npy file, the notes played go to a small json sidecar
+CAPTURE_DTYPE = np.dtype("<f4")
+
+
+def metadata_path(path: str) -> str:
+    '''
+    data/waveform.npy -> data/waveform.meta.json
+    '''
+    return os.path.splitext(path)[0] + ".meta.json"
+
+def _write_header(fp, num_samples: int) -> None:
+    np.lib.format.write_array_header_1_0(
+        fp,
+        {"descr": CAPTURE_DTYPE.str, "fortran_order": False, "shape": (num_samples,)}
+    )
+
+def _write_metadata(path: str, key_sequence: List[float], timestamps: List[int], sample_rate: int) -> None:
+    with open(metadata_path(path), "w") as fp:
+        json.dump(
+            {"sample_rate": sample_rate, "key_sequence": key_sequence, "timestamps": timestamps},
+            fp
+        )
+
+def save_capture(
+    path: str,
+    samples: np.ndarray,
+    key_sequence: Optional[List[float]] = None,
+    timestamps: Optional[List[int]] = None,
+    sample_rate: int = SAMPLE_RATE
+) -> None:
+    np.save(path, np.asarray(samples, dtype=CAPTURE_DTYPE))
+    _write_metadata(path, key_sequence or [], timestamps or [], sample_rate)
+
+def load_capture(path: str) -> Tuple[np.ndarray, dict]:
+    '''
+    Opens a capture memory-mapped, only the pages that are sliced are read from disk.
+    Legacy json captures are parsed in memory.
+
+    Returns:
+        Tuple[np.ndarray, dict]: the samples and the metadata (sample_rate, key_sequence, timestamps).
+    '''
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No file found at path: {path}")
+    if path.endswith(".json"):
+        with open(path, "r") as fp:
+            data = json.load(fp)
+        signal = np.array(data.get("data", []), dtype=CAPTURE_DTYPE)
+        metadata = {
+            "sample_rate": data.get("sample_rate", SAMPLE_RATE),
+            "key_sequence": data.get("key_sequence", []),
+            "timestamps": data.get("timestamps", []),
+        }
+        return signal, metadata
+
+    signal = np.load(path, mmap_mode="r")
+    metadata = {"sample_rate": SAMPLE_RATE, "key_sequence": [], "timestamps": []}
+    if os.path.isfile(metadata_path(path)):
+        with open(metadata_path(path), "r") as fp:
+            metadata.update(json.load(fp))
+    return signal, metadata
+
+def convert_json_capture(json_path: str, path: Optional[str] = None) -> str:
+    '''
+    Converts a json capture (as written by older versions of custom_keyboard) to the binary format.
+    Returns the path of the .npy file, next to the json one by default.
+    '''
+    if path is None:
+        path = os.path.splitext(json_path)[0] + ".npy"
+    signal, metadata = load_capture(json_path)
+    save_capture(path, signal, metadata["key_sequence"], metadata["timestamps"], metadata["sample_rate"])
+    return path
+
+
+class CaptureWriter():
+    '''
+    Streams the output of the audio callback to a capture file.
+    The audio thread only copies blocks into preallocated chunks; full chunks are written to
+    disk by a background thread. If the disk falls behind and no chunk is free, samples are
+    dropped and counted rather than blocking the audio thread.
+    Samples go to path + ".part", which close renames to path and discard deletes, so the
+    previous capture at path stays intact until a new one is complete.
+    '''
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: int = SAMPLE_RATE,
+        chunk_duration: float = 1.0,
+        num_chunks: int = 8
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.key_sequence = []
+        self.timestamps = []
+        self.num_samples = 0
+        self.dropped_samples = 0
+
+        chunk_size = int(chunk_duration * sample_rate)
+        self._free = queue.SimpleQueue()
+        for _ in range(num_chunks):
+            self._free.put(np.zeros(chunk_size, dtype=CAPTURE_DTYPE))
+        self._full = queue.SimpleQueue()
+        self._chunk = self._free.get()
+        self._position = 0
+
+        self._fp = open(path + ".part", "wb")
+        _write_header(self._fp, 0)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            chunk, length = self._full.get()
+            if chunk is None:
+                break
+            self._fp.write(chunk[:length].tobytes())
+            self._free.put(chunk)
+
+    def write(self, block: np.ndarray) -> None:
+        '''
+        Appends a block of samples, called from the audio thread.
+        '''
+        start = 0
+        while start < len(block):
+            if self._chunk is None:
+                try:
+                    self._chunk = self._free.get_nowait()
+                    self._position = 0
+                except queue.Empty:
+                    self.dropped_samples += len(block) - start
+                    return
+            length = min(len(block) - start, len(self._chunk) - self._position)
+            np.copyto(self._chunk[self._position:self._position + length], block[start:start + length])
+            self._position += length
+            start += length
+            if self._position == len(self._chunk):
+                self._full.put((self._chunk, self._position))
+                self.num_samples += self._position
+                self._chunk = None
+
+    def add_event(self, key: float, timestamp: int) -> None:
+        self.key_sequence.append(key)
+        self.timestamps.append(timestamp)
+
+    def close(self) -> None:
+        '''
+        Flushes the last chunk, fixes the sample count in the header, writes the sidecar
+        and moves the capture to path.
+        '''
+        self._stop()
+        # The header is padded to a fixed size, so it can be rewritten in place
+        header_size = self._fp.tell() - self.num_samples * CAPTURE_DTYPE.itemsize
+        self._fp.seek(0)
+        _write_header(self._fp, self.num_samples)
+        if self._fp.tell() != header_size:
+            raise RuntimeError("Capture header size changed, the file is corrupted.")
+        self._fp.close()
+        _write_metadata(self.path, self.key_sequence, self.timestamps, self.sample_rate)
+        os.replace(self.path + ".part", self.path)
+
+    def discard(self) -> None:
+        '''
+        Stops the capture and deletes it, the previous capture at path is left as it was.
+        '''
+        self._stop()
+        self._fp.close()
+        os.remove(self.path + ".part")
+
+    def _stop(self) -> None:
+        '''
+        Writes the last chunk and waits for the writer thread.
+        '''
+        if self._chunk is not None and self._position > 0:
+            self._full.put((self._chunk, self._position))
+            self.num_samples += self._position
+            self._chunk = None
+        self._full.put((None, 0))
+        self._thread.join()
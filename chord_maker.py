@@ -1,5 +1,9 @@
-from synthesis import play_chord_with_envelope, generate_envelope
-from utils import notes2freqs
+import re
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+from utils import SAMPLE_RATE, notes2freqs
 
 NUM_OCTAVES = 5
 NOTES = [
@@ -8,6 +12,16 @@ NOTES = [
     for y in range(NUM_OCTAVES)
     for x in ["A", "A#", "B", "C", "C#", "D", "D#", "E", "F", "F#", "G", "G#"]
     ]
+NOTE_INDEX = {note: idx for idx, note in enumerate(NOTES)}
+
+# Symbols precompiled by compileChords: [octave] root quality
+CHORD_ROOTS = ["A", "A#", "Bb", "B", "C", "C#", "Db", "D", "D#", "Eb", "E", "F", "F#", "Gb", "G", "G#", "Ab"]
+CHORD_QUALITIES = [
+    "", "min", "m", "dim", "aug", "6", "min6", "m6",
+    "7", "min7", "m7", "maj7", "dim7", "aug7",
+    "9", "min9", "m9", "maj9",
+    ]
+CHORD_OCTAVES = [""] + [str(octave) for octave in range(NUM_OCTAVES)]
 
 def flatToSharp(note : str):
     def decrement_letter(letter):
@@ -40,19 +54,24 @@ def buildChord(chordStr):
         octaveNumber = chordStr[0]
         chordStr = chordStr[1:]
     fundamental = chordStr[0] if '#' not in chordStr and 'b' not in chordStr else chordStr[:2] # c or E or G#
+    # Minor is spelled min or m, the m of maj is not minor
+    quality = chordStr[len(fundamental):]
+    minor = quality.startswith("m") and not quality.startswith("maj")
     fundamental = flatToSharp(fundamental)
 
     # We can specify the octave in the prompt [0 - 4], by default its 3 (mid tones)
 
     fundamental += octaveNumber
-    noteIdx = NOTES.index(fundamental)
+    if fundamental not in NOTE_INDEX:
+        raise ValueError(f"Unknown chord root: {fundamental}")
+    noteIdx = NOTE_INDEX[fundamental]
 
     chord = [
         fundamental
     ]
 
     # Thirds
-    if "min" in chordStr or "dim" in chordStr:
+    if minor or "dim" in chordStr:
         chord.append(minorThird(noteIdx))
     else:
         chord.append(majorThird(noteIdx))
@@ -77,7 +96,7 @@ def buildChord(chordStr):
 
     # Nineth
     if "9" in chordStr:
-        if "min" in chordStr:
+        if minor:
             chord.append(minorSeventh(noteIdx))
             chord.append(nineth(noteIdx))
         else :
@@ -86,13 +105,61 @@ def buildChord(chordStr):
 
     return chord
 
-def decodeChordSequence(chordSequence : str):
-    return
+# Frequencies of every chord symbol, filled once by compileChords
+CHORD_TABLE: Dict[str, np.ndarray] = {}
+
+def compileChords() -> Dict[str, np.ndarray]:
+    '''
+    Builds, once, the lookup table from every supported symbol (octave x root x quality)
+    to the frequencies of its notes, so that playing a chord does not parse it again.
+    '''
+    if not CHORD_TABLE:
+        for octave in CHORD_OCTAVES:
+            for root in CHORD_ROOTS:
+                for quality in CHORD_QUALITIES:
+                    symbol = f"{octave}{root}{quality}"
+                    CHORD_TABLE[symbol] = np.array(list(notes2freqs(buildChord(symbol))))
+        # Both spellings of a minor chord must give its minor third
+        for quality in ("m", "m6", "m7", "m9"):
+            if not np.array_equal(CHORD_TABLE[f"C{quality}"], CHORD_TABLE[f"Cmin{quality[1:]}"]):
+                raise RuntimeError(f"C{quality} does not compile to the same chord as Cmin{quality[1:]}.")
+    return CHORD_TABLE
+
+def chordFrequencies(chordStr : str) -> np.ndarray:
+    '''
+    Frequencies of a chord symbol, from the precompiled table.
+    Symbols outside of the table are parsed with buildChord and added to it.
+    '''
+    table = compileChords()
+    frequencies = table.get(chordStr)
+    if frequencies is None:
+        frequencies = np.array(list(notes2freqs(buildChord(chordStr))))
+        table[chordStr] = frequencies
+    return frequencies
+
+def decodeChordSequence(
+        chordSequence : str,
+        tempo : float = 120,
+        beats : float = 4,
+        sample_rate : int = SAMPLE_RATE
+) -> Iterator[Tuple[int, np.ndarray]]:
+    '''
+    Streams a progression such as "Gmin F6 Abmaj7:2 Abmaj7:2" as (start_sample, frequencies) events.
+    Each chord lasts beats beats, unless its symbol ends with :<beats>.
+    A last event with no frequencies marks the end of the progression.
+    '''
+    samplesPerBeat = 60 / tempo * sample_rate
+    position = 0.0  # In beats, so that rounding errors do not accumulate
+    for match in re.finditer(r"\S+", chordSequence):
+        symbol, _, duration = match.group().partition(":")
+        yield round(position * samplesPerBeat), chordFrequencies(symbol)
+        position += float(duration) if duration else beats
+    yield round(position * samplesPerBeat), np.array([])
 
 def getNote(idx):
-    if idx > len(NOTES):
+    while idx >= len(NOTES):
         # Lower an octave
-        return NOTES[idx - 12]
+        idx -= 12
     return NOTES[idx]
 
 def minorThird(noteIdx):
@@ -149,15 +216,16 @@ if __name__ == "__main__":
     #     "2Ebmaj7", "2Bb", "2D7", "2G",
     #     "2Cm7", "2D7", "2G7", "2G"
     #     ]
-    duration = 2
-    t, envelope = generate_envelope(
-        duration=duration,
-        attack_time=0.3,
-        decay_time=0.1,
-        sustain_level=1,
-        release_time=1
+    # Imported here, render builds on this module
+    from envelope import ADSREnvelope
+    from render import render_chord_sequence
+
+    envelope = ADSREnvelope(
+        attack=0.3,
+        decay=0.1,
+        sustain=1,
+        release=1
         )
-
-    for chord in chordSequence:
-        play_chord_with_envelope(notes2freqs(buildChord(chord)), duration, envelope)
+    # 2 seconds per chord
+    render_chord_sequence(chordSequence, "chords.wav", tempo=120, beats=4, envelope=envelope)
 
@@ -1,67 +1,160 @@
+import queue
 import threading
 
 import numpy as np
 import sounddevice as sd
 
-from chord_maker import buildChord
-from synthesis import generate_envelope, generate_tone_with_envelope
-from utils import SAMPLE_RATE, notes2freqs
+from chord_maker import chordFrequencies
+from envelope import ADSREnvelope
+from graph import AudioGraph, EnvelopeNode, OscillatorNode
+from utils import DTYPE, SAMPLE_RATE
 
-# Multithreading
-chord_thread = None
-stop_event = threading.Event()
+BLOCKSIZE = 256  # Frames per block, the first block of a chord is ready a few ms after Enter
+FADE_BLOCKS = 8  # Length of the crossfade between two chords, in blocks
 
-def chord_runner(frequencies, duration, envelope):
+
+def chord_blocks(frequencies, duration, envelope, blocksize=BLOCKSIZE):
+    '''
+    Renders the chord block by block, as it is played: nothing is computed ahead of the stream.
+    The same utils.DTYPE buffer is yielded every time, so memory does not depend on the duration.
+    The chord ends after duration, or earlier if its envelope is released and fades out.
+    '''
+    # All the notes of the chord are rendered and mixed together, then shaped by the envelope
+    oscillator = OscillatorNode(list(frequencies), harmonics=[1.0], waveform="sinus", sample_rate=SAMPLE_RATE)
+    engine = AudioGraph(EnvelopeNode(oscillator, envelope))
+    # The release ends with the chord
+    envelope.note_on()
+    envelope.note_off(delay=duration - envelope.release / SAMPLE_RATE)
+
+    out = np.zeros(blocksize, dtype=DTYPE)
+    total = int(duration * SAMPLE_RATE)
+    for start in range(0, total, blocksize):
+        block = out[:min(blocksize, total - start)]
+        engine.render_into(block)
+        yield block
+        if not envelope.active:
+            return
+
+
+class ChordPlayer():
     '''
-    Executes play_chord_with_envelope with conditionnal stop
+    One output stream and one render thread for the whole session, driven by commands put on a queue:
+    ("play", frequencies, duration, envelope), ("release",), ("stop",) and ("close",).
+    Commands are read between two blocks, a new chord or a stop fades the previous one out over FADE_BLOCKS
+    blocks. A chord already fading finishes its own fade.
+    Silence is written while no chord plays, so the device never underflows.
     '''
-    global stop_event
-    stop_event.clear()
-    t = np.linspace(0, duration, int(SAMPLE_RATE * duration), endpoint=False)
-    signal = t * 0
-    for frequency in frequencies:
-        signal += generate_tone_with_envelope(frequency, duration, envelope, SAMPLE_RATE)
-
-    try:
-        stream = sd.OutputStream(samplerate=SAMPLE_RATE, channels=1)
-        with stream:
-            for chunk in np.array_split(signal, 100):
-                if stop_event.is_set():
-                    break
-                stream.write(chunk.astype(np.float32))
-    except Exception as e:
-        print(f"Error playing chord: {e}")
+
+    def __init__(self, blocksize=BLOCKSIZE, fade_blocks=FADE_BLOCKS):
+        self.blocksize = blocksize
+        self.commands = queue.Queue()
+        # Gain of the chord fading out for each block of the crossfade, the new chord gets 1 - gain
+        self.fade_out = np.linspace(1, 0, fade_blocks * blocksize, endpoint=False, dtype=DTYPE)
+        self.fade_out = self.fade_out.reshape(fade_blocks, blocksize)
+        self.fade_in = 1 - self.fade_out
+        self.mix = np.zeros(blocksize, dtype=DTYPE)
+        self.thread = None
+        self.stream = None
+
+    def start(self):
+        self.stream = sd.OutputStream(
+            samplerate=SAMPLE_RATE,
+            channels=1,
+            dtype=DTYPE.name,
+            blocksize=self.blocksize,
+            latency="low"
+        )
+        self.stream.start()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def play(self, frequencies, duration, envelope):
+        self.commands.put(("play", frequencies, duration, envelope))
+
+    def release(self):
+        self.commands.put(("release",))
+
+    def stop(self):
+        self.commands.put(("stop",))
+
+    def close(self):
+        self.commands.put(("close",))
+        self.thread.join()
+        self.stream.close()
+
+    def _run(self):
+        current = None  # (blocks, envelope) of the chord playing
+        fade = len(self.fade_in)  # Blocks since the chord playing started, it fades in over the first ones
+        fading = []  # [blocks, blocks faded] of the previous chords, each one until its own fade ends
+        try:
+            while True:
+                while not self.commands.empty():
+                    command = self.commands.get_nowait()
+                    if command[0] == "close":
+                        return
+                    if command[0] == "release":
+                        if current is not None:
+                            current[1].note_off()
+                        continue
+                    # play and stop both fade the current chord out, the chords already fading go on
+                    if current is not None:
+                        fading.append([current[0], 0])
+                        current = None
+                    if command[0] == "play":
+                        _, frequencies, duration, envelope = command
+                        current = (chord_blocks(frequencies, duration, envelope, self.blocksize), envelope)
+                        fade = 0
+
+                self.mix.fill(0)
+                if current is not None:
+                    block = next(current[0], None)
+                    if block is None:
+                        current = None
+                    elif fade < len(self.fade_in):
+                        self.mix[:len(block)] += block * self.fade_in[fade, :len(block)]
+                    else:
+                        self.mix[:len(block)] += block
+                    fade += 1
+                for chord in fading:
+                    block = next(chord[0], None)
+                    if block is not None:
+                        self.mix[:len(block)] += block * self.fade_out[chord[1], :len(block)]
+                    chord[1] += 1
+                fading = [chord for chord in fading if chord[1] < len(self.fade_out)]
+                self.stream.write(self.mix)
+        except Exception as e:
+            print(f"Error playing chord: {e}")
 
 
 def main():
-    global chord_thread, stop_event
+    player = ChordPlayer()
+    player.start()
+    print("Enter a chord to play it, r to release it, s to stop it and q to quit")
 
     while True:
         chordPrompt = input("Enter chord :")
         if chordPrompt.lower() == 'q':
-            if chord_thread and chord_thread.is_alive():
-                stop_event.set()
-                chord_thread.join()
+            player.close()
             break
+        if chordPrompt.lower() == 'r':
+            player.release()
+            continue
+        if chordPrompt.lower() == 's':
+            player.stop()
+            continue
 
         try:
-            frequencies = notes2freqs(buildChord(chordPrompt))
+            frequencies = chordFrequencies(chordPrompt)
             duration = 10  # Durée en secondes
 
-            _, envelope = generate_envelope(
-                duration=duration,
-                attack_time=0.5,
-                decay_time=0.1,
-                sustain_level=0.5,
-                release_time=0.1
+            envelope = ADSREnvelope(
+                attack=0.5,
+                decay=0.1,
+                sustain=0.5,
+                release=0.1,
+                sample_rate=SAMPLE_RATE
                 )
-            if chord_thread and chord_thread.is_alive():
-                stop_event.set()
-                chord_thread.join()
-
-            stop_event.clear()
-            chord_thread = threading.Thread(target=chord_runner, args=(frequencies, duration, envelope))
-            chord_thread.start()
+            player.play(frequencies, duration, envelope)
         except ValueError:
             print("Invalid input. Please enter comma-separated numbers.")
 
@@ -1,121 +1,225 @@
 import argparse
-import json
 import threading
-from datetime import datetime 
+from time import perf_counter
 
 import numpy as np
 import sounddevice as sd
 
 import parameters as p
+from capture import CaptureWriter
 from debug import plot_waveform, plot_spectrum, default_path
-from synthesis import generate_tone, generate_envelope
-from utils import KEY2FREQ, SAMPLE_RATE
+from envelope import ADSREnvelope
+from graph import AudioGraph, VoicePoolNode
+from ringbuffer import RenderAhead
+from shards import ShardedVoicePool
+from telemetry import CallbackTelemetry, KeyLatency
+from utils import DTYPE, KEY2FREQ, SAMPLE_RATE
+from voices import VoicePool
 
-# Envelop is generated once for the whole note, then each chunk is applied during audio_callback
-current_envelope = None  # Envelope of the current note
-current_envelope_position = 0  # Position in the envelope
+# Every note is a voice of the pool, all active voices are rendered together during audio_callback
+voice_pool = None
+# Audio graph pulled by audio_callback, its source is the voice pool
+engine = None
+# With render ahead, a producer thread renders the voices and audio_callback only copies blocks
+render_ahead = None
 
-lock = threading.Lock()  # To safely update shared variables
 stop_event = threading.Event() # Event to stop playback
 
+# Stream clock: first sample of the current block and time its callback started, samples handed to the stream
+block_start = 0
+block_time = 0.0
+played = 0
+# Delay in samples between a key press and its note-on, see note_sample
+note_delay = 0
+
+# Render time and xruns of audio_callback, and key-to-sound latency
+telemetry = None
+key_latency = KeyLatency()
+output_latency = 0.0  # Latency of the stream reported by PortAudio
+
 # For debugging
-waveform_data = []  # Stores the waveform if DEBUG_MODE is active
+capture = None  # Streams the waveform to default_path if DEBUG_MODE is active
 
 def audio_callback(outdata, frames, time, status):
     """Audio callback to generate and stream the sound in real-time."""
-    global current_phases, current_frequency, current_envelope, current_envelope_position, waveform_data
-
+    global played, block_start, block_time
+    start = telemetry.begin()
+    # Saved together so that note_sample never mixes the start of a block with the time of another
+    block_start = played
+    block_time = start
+    played += frames
     if stop_event.is_set():
         outdata.fill(0)
         return
 
-    with lock:
-        frequency = current_frequency
-        phases = current_phases
-        envelope = current_envelope
-        envelope_position = current_envelope_position
-
-    duration = frames / SAMPLE_RATE
-    if frequency > 0:
-        print(f"avant gen : {phases}")
-        wave, phases = generate_tone(
-            frequency,
-            duration,
-            sample_rate=SAMPLE_RATE,
-            initial_phases=phases,
-            waveform=p.WAVEFORM,
-            harmonics=p.HARMONICS
-        )
+    # Nothing is allocated nor printed here, the voices are mixed straight into the stream buffer
+    if render_ahead is None:
+        engine.render_into(outdata[:, 0])
+    else:
+        render_ahead.ring.read_into(outdata[:, 0])
 
-        # Apply the corresponding portion of the envelope
-        if envelope is not None:
-            start_idx = envelope_position
-            end_idx = start_idx + frames
-            chunk_envelope = envelope[start_idx:end_idx]
-            wave[:len(chunk_envelope)] *= chunk_envelope
-            envelope_position += frames
+    # Some host APIs do not report the DAC time, the stream latency is used instead
+    output_delay = time.outputBufferDacTime - time.currentTime
+    key_latency.rendered(block_start, frames, output_delay if output_delay > 0 else output_latency)
 
-            # If we've reached the end of the envelope, stop the note
-            if envelope_position >= len(envelope):
-                wave[len(chunk_envelope):] = 0
-                frequency = 0  # Stop the note
+    # Save waveform data for debugging
+    if DEBUG:
+        capture.write(outdata[:, 0])
 
-            # Save waveform data for debugging
-        if DEBUG:
-            waveform_data.extend(wave)
+    telemetry.end(start, status)
 
-    else:
-        wave = np.zeros(frames)
+def calibrate(blocksize, polyphony=p.POLYPHONY, blocks=50):
+    """
+    Renders blocks with every voice playing, as the callback would, and returns the 99th percentile
+    of the render time as a share of the block duration.
+    """
+    calibration = CallbackTelemetry(blocksize, sample_rate=SAMPLE_RATE)
+    outdata = np.zeros((blocksize, 1), dtype=DTYPE)
+    for i in range(polyphony):
+        voice_pool.note_on(KEY2FREQ["q"] * 2 ** (i / 12))
+    engine.render_into(outdata[:, 0])  # Warm-up
+    for _ in range(blocks):
+        start = calibration.begin()
+        engine.render_into(outdata[:, 0])
+        calibration.end(start)
+    voice_pool.all_notes_off()
+    return calibration.percentile(99)
 
-    with lock:
-        current_phases = phases  # Update global phase to keep track of where we are
-        current_frequency = frequency
-        current_envelope_position = envelope_position
+def select_profile(profile=p.LATENCY_PROFILE):
+    """
+    Returns the name of the first profile, from the requested one towards the safest one,
+    whose calibration render fits in p.MAX_UTILIZATION of the block duration.
+    """
+    names = list(p.LATENCY_PROFILES)
+    if profile not in names:
+        raise ValueError(f"Unsupported latency profile. Choose among {', '.join(names)}.")
+    for name in names[names.index(profile):]:
+        blocksize = p.LATENCY_PROFILES[name]["blocksize"]
+        engine.prepare(blocksize)  # Scratch buffers are allocated before the audio thread starts
+        utilization = calibrate(blocksize)
+        print(f"Profile {name}: {blocksize} frames per block, {100 * utilization:.0f} % of the block duration used")
+        if utilization <= p.MAX_UTILIZATION:
+            return name
+    print(f"No profile fits in {100 * p.MAX_UTILIZATION:.0f} % of the block duration, using {name}")
+    return name
 
-    outdata[:] = wave.reshape(-1, 1)
+def check_note_timing(blocksize):
+    """
+    Presses a key through note_sample half a block after the first callback started, renders the
+    blocks up to its note and checks that it lands note_delay samples after the press and starts
+    on that sample. The stream clock and the pool clock are reset before and after.
+    """
+    global played, block_start, block_time
+    voice_pool.reset_clock()
+    offset = blocksize // 2
+    block_start, played = 0, blocksize
+    block_time = perf_counter() - offset / SAMPLE_RATE
+    sample = note_sample()
+    voice_pool.schedule(sample, "note_on", KEY2FREQ["q"], p.AMPLITUDE)
+    signal = np.zeros(((sample + 1) // blocksize + 1) * blocksize, dtype=DTYPE)
+    for block in signal.reshape(-1, blocksize):
+        engine.render_into(block)
+    voice_pool.all_notes_off()
+    voice_pool.reset_clock()
+    block_start, block_time, played = 0, 0.0, 0
 
-def start_audio_stream():
-    """Start the audio stream."""
-    global current_phases, current_frequency
-    current_phases = None  # Reset phase at the start
-    current_frequency = 0  # No note initially
+    # Only the few samples between block_time and note_sample may be added to the press
+    expected = note_delay + offset
+    if not expected <= sample < expected + blocksize // 4:
+        raise RuntimeError(
+            f"A key pressed at sample {offset} of a block landed on {sample} instead of {expected}, key timing is off."
+        )
+    # The attack and the sine both start at 0, the first sound is one sample after the note-on
+    if np.any(signal[:sample + 1]) or signal[sample + 1] == 0:
+        onset = np.flatnonzero(signal)
+        raise RuntimeError(
+            f"A note scheduled at sample {sample} started at "
+            f"{onset[0] - 1 if len(onset) > 0 else 'no sample'}, key timing is off."
+        )
+
+def start_audio_stream(depth=p.RENDER_AHEAD, profile=p.LATENCY_PROFILE, workers=p.WORKERS):
+    """
+    Start the audio stream with the given latency profile, rendering depth blocks ahead of it if depth > 0
+    and the voices in workers processes if workers > 0.
+    """
+    global voice_pool, engine, capture, render_ahead, telemetry, output_latency, note_delay
+    # Envelope settings are shared by every note, each voice streams its own position
+    envelope = ADSREnvelope(p.ATTACK, p.DECAY, p.SUSTAIN, p.RELEASE, sample_rate=SAMPLE_RATE)
+    if workers > 0:
+        voice_pool = ShardedVoicePool(
+            size=p.POLYPHONY,
+            harmonics=p.HARMONICS,
+            waveform=p.WAVEFORM,
+            envelope=envelope,
+            sample_rate=SAMPLE_RATE,
+            workers=workers
+        )
+    else:
+        voice_pool = VoicePool(
+            size=p.POLYPHONY,
+            harmonics=p.HARMONICS,
+            waveform=p.WAVEFORM,
+            envelope=envelope,
+            sample_rate=SAMPLE_RATE
+        )
+    if DEBUG:
+        capture = CaptureWriter(default_path, sample_rate=SAMPLE_RATE)
+    engine = AudioGraph(VoicePoolNode(voice_pool))
+    profile = select_profile(profile)
+    blocksize = p.LATENCY_PROFILES[profile]["blocksize"]
+    # One block after the block playing, and after the blocks rendered ahead of it
+    note_delay = (1 + depth) * blocksize
+    # The pool clock, moved by the calibration, restarts at 0 with the stream clock
+    check_note_timing(blocksize)
+    telemetry = CallbackTelemetry(blocksize, sample_rate=SAMPLE_RATE)
+    if depth > 0:
+        render_ahead = RenderAhead(engine.render_into, blocksize, depth=depth, sample_rate=SAMPLE_RATE)
+        render_ahead.start()
     stream = sd.OutputStream(
         samplerate=SAMPLE_RATE,
         channels=1,
+        dtype=DTYPE.name,
         callback=audio_callback,
-        blocksize=int(p.CHUNK_DURATION * SAMPLE_RATE),
+        blocksize=blocksize,
+        latency=p.LATENCY_PROFILES[profile]["latency"],
     )
+    output_latency = stream.latency
     stream.start()
+    print(f"Block of {1e3 * blocksize / SAMPLE_RATE:.1f} ms, stream latency {1e3 * output_latency:.1f} ms")
 
 
+def note_sample():
+    """
+    Sample of the pool clock a key pressed now starts on: the time since the current block
+    started, note_delay samples later. The delay is constant instead of the up to one block
+    of waiting for the next callback, since the renderer splits its block at that sample.
+    """
+    return block_start + note_delay + int((perf_counter() - block_time) * SAMPLE_RATE)
+
 def play_note(note):
-    """Start playing a note."""
-    global current_frequency, current_envelope, current_envelope_position
-
-    with lock:
-        current_frequency = KEY2FREQ[note]
-        current_envelope = generate_envelope(p.DURATION, p.ATTACK, p.DECAY, sample_rate=SAMPLE_RATE)
-        current_envelope_position = 0
-
-def stop_note():
-    """Stop playing the current note."""
-    global current_frequency, current_envelope, current_envelope_position
-    with lock:
-        current_frequency = 0
-        current_envelope = None
-        current_envelope_position = 0
+    """Start playing a note, on top of the ones already playing. Returns the sample it starts on."""
+    sample = note_sample()
+    key_latency.press(sample)
+    voice_pool.schedule(sample, "note_on", KEY2FREQ[note], p.AMPLITUDE, p.DURATION)
+    return sample
+
+def stop_note(note=None):
+    """Release a note, or stop every note if none is given."""
+    if note is None:
+        voice_pool.schedule(note_sample(), "all_notes_off")
+    else:
+        voice_pool.schedule(note_sample(), "note_off", KEY2FREQ[note])
 
 def downsample_waveform(data, downsample_factor):
     """Downsample waveform by the given factor."""
     return data[::downsample_factor]  # Downsample the waveform by factor
 
-def main():
+def main(depth=p.RENDER_AHEAD, log_interval=0, profile=p.LATENCY_PROFILE, workers=p.WORKERS):
+    global capture
     print("Press a key")
-    start_audio_stream()  # Start audio playback
-    if DEBUG:
-        key_sequence = []
-        timestamps = []
-        tStart = datetime.now()
+    start_audio_stream(depth, profile, workers)  # Start audio playback
+    if log_interval > 0:
+        telemetry.start_logging(log_interval)
     # TODO : find a way to use the keyboard lib or pynput, now we need to press enter for eahc note
     while True:
         try:
@@ -124,29 +228,36 @@ def main():
                 stop_event.set()
                 break
             elif note == "save" and DEBUG:
-
-                formatted_waveform = {
-                    "data" : waveform_data,
-                    "key_sequence" : key_sequence,
-                    "timestamps" : timestamps
-                }
-                # TODO : investigate why this provoques a segfault
-                # plot_waveform(np.array(waveform_data, dtype=np.float32), 1)    
-                
-                with open("data/waveform.json", 'w') as fp:
-                    json.dump(formatted_waveform, fp)
+                # Samples are already on disk, this writes the last chunk and the key sequence
                 stop_event.set()
+                capture.close()
+                capture = None
                 break
             elif note in KEY2FREQ:
-                play_note(note)
+                sample = play_note(note)
                 if DEBUG:
-                    key_sequence.append(KEY2FREQ[note])
-                    timestamps.append(int((datetime.now() - tStart).total_seconds() * SAMPLE_RATE))
+                    # The pool clock counts the samples written to the capture
+                    capture.add_event(KEY2FREQ[note], sample)
             else:
                 print("Invalid key.")
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError):
             stop_event.set()
             break
+    if DEBUG and capture is not None:
+        # Only "save" keeps the capture, any other exit deletes it and leaves the previous one as it was
+        capture.discard()
+
+    telemetry.stop_logging()
+    print(telemetry.log_line())
+    latency = key_latency.snapshot()
+    if latency["notes"] > 0:
+        print(f"Key-to-sound latency: mean {1e3 * latency['mean']:.1f} ms, max {1e3 * latency['max']:.1f} ms")
+    if render_ahead is not None:
+        render_ahead.stop()
+        print(f"Underruns: {render_ahead.underruns}")
+    if isinstance(voice_pool, ShardedVoicePool):
+        print(f"Late shard blocks: {voice_pool.late_blocks}, missed and caught up: {voice_pool.missed_blocks}")
+        voice_pool.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -155,13 +266,37 @@ if __name__ == "__main__":
         action="store_true",
         help="Activates debug plots"
     )
+    parser.add_argument(
+        "--render-ahead",
+        type=int,
+        default=p.RENDER_AHEAD,
+        help="Number of blocks rendered ahead by a producer thread (0 renders in the audio callback)"
+    )
+    parser.add_argument(
+        "--telemetry",
+        type=float,
+        default=0,
+        help="Interval in seconds between callback timing logs (0 only logs on exit)"
+    )
+    parser.add_argument(
+        "--latency",
+        choices=list(p.LATENCY_PROFILES),
+        default=p.LATENCY_PROFILE,
+        help="Latency profile, falls back to a safer one if the machine cannot sustain its block size"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=p.WORKERS,
+        help="Number of processes rendering the voices (0 renders them in the audio thread)"
+    )
     args = parser.parse_args()
     DEBUG = args.debug
 
-    main()
+    main(args.render_ahead, args.telemetry, args.latency, args.workers)
 
     # Check why this creates a segfault
     # if args.debug:
-    #     # If True, we dump data into a json file for further observation
+    #     # If True, we dump data into a capture file for further observation
     #     plot_waveform(default_path, slice=[0, 2 * p.CHUNK_DURATION * SAMPLE_RATE])
     #     plot_spectrum(default_path)
\ No newline at end of file
@@ -1,13 +1,14 @@
 import argparse
-import json
-import logging
 import os
-from typing import Optional, List, Union
+import tempfile
+from typing import Iterator, Optional, List, Tuple, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
 
 import parameters as p
+from capture import convert_json_capture, load_capture
+from pitch import cents_error, closest_note
 from utils import SAMPLE_RATE
 
 
@@ -20,19 +21,15 @@ def plot_waveform(
     Plots an audio signal.
 
     Args:
-        data (str | np.ndarray): The input data. It can be either the path to a JSON file containing the signal
-            or a NumPy array representing the signal directly.
+        data (str | np.ndarray): The input data. It can be either the path to a capture file (.npy, or legacy .json)
+            containing the signal or a NumPy array representing the signal directly.
         save (bool, optional): If True, saves the plot as an image file. Defaults to False.
         slice (List[int], optional): Defines a range of the signal to plot as [start, end]. If None, plots the entire signal.
             Defaults to None.
     """
-    # Load data if it's a file path
+    # Captures are memory-mapped, slicing only reads the corresponding pages
     if isinstance(data, str):
-        if os.path.isfile(data): 
-            with open(data, 'r') as file:
-                signal = np.array(json.load(file).get("data", []))
-        else:
-            raise FileNotFoundError(f"No file found at path: {data}")
+        signal, _ = load_capture(data)
     elif isinstance(data, np.ndarray):
         signal = data
     else:
@@ -55,31 +52,21 @@ def plot_spectrum(
     Loads an audio signal and plots its spectrum.
 
     Args:
-        data (str | np.ndarray): The input data. It can be either the path to a JSON file containing the signal
-            or a NumPy array representing the signal directly.
+        data (str | np.ndarray): The input data. It can be either the path to a capture file (.npy, or legacy .json)
+            containing the signal or a NumPy array representing the signal directly.
         save (bool, optional): If True, saves the plot as an image file. Defaults to False.
     """
     # Load the audio signal
     if isinstance(data, str):
-        if os.path.isfile(data):
-            with open(data, 'r') as file:
-                try:
-                    signal = np.array(json.load(file)["data"])
-                except (KeyError, ValueError, TypeError) as e:
-                    logging.error(f"Failed to load data from {data}: {e}")
-                    return
-        else:
-            raise FileNotFoundError(f"No file found at path: {data}")
+        signal, _ = load_capture(data)
     elif isinstance(data, np.ndarray):
         signal = data
     else:
         raise TypeError("The 'data' argument must be a string (file path) or a NumPy array.")
 
-    # Compute FFT and frequencies
-    fft_values = np.fft.fft(signal)
-    frequencies = np.fft.fftfreq(len(signal), d=1 / SAMPLE_RATE)
-    positive_freq = frequencies[:len(signal) // 2]
-    spectrum = np.abs(fft_values)[:len(signal) // 2]
+    # The signal is real, only the positive frequencies are computed
+    spectrum = np.abs(np.fft.rfft(signal))
+    positive_freq = np.fft.rfftfreq(len(signal), d=1 / SAMPLE_RATE)
 
     # Plot the spectrum
     plt.figure(figsize=(10, 6))
@@ -95,7 +82,188 @@ def plot_spectrum(
     else:
         plt.show()
 
-default_path = "data/waveform.json"
+def _load_signal(data: Union[str, np.ndarray], sample_rate: int) -> Tuple[np.ndarray, int]:
+    if isinstance(data, str):
+        signal, metadata = load_capture(data)
+        return signal, metadata.get("sample_rate", sample_rate)
+    if isinstance(data, np.ndarray):
+        return data, sample_rate
+    raise TypeError("The 'data' argument must be a string (file path) or a NumPy array.")
+
+def iter_stft(
+    signal: np.ndarray,
+    window_size: int = 2048,
+    hop: int = 512,
+    chunk_frames: int = 256
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Short-time Fourier transform computed chunk by chunk, so that at most chunk_frames windows
+    are in memory at once. Only the part of a memory-mapped signal under the chunk is read.
+
+    Args:
+        signal (np.ndarray): The audio signal, possibly memory-mapped.
+        window_size (int, optional): Length of the Hann window in samples. Defaults to 2048.
+        hop (int, optional): Samples between two windows. Defaults to 512.
+        chunk_frames (int, optional): Windows transformed per chunk. Defaults to 256.
+
+    Yields:
+        Tuple[int, np.ndarray]: Index of the first frame of the chunk and its (frames, window_size // 2 + 1)
+            magnitudes.
+    """
+    window = np.hanning(window_size).astype(np.float32)
+    num_frames = max((len(signal) - window_size) // hop + 1, 0)
+    for first in range(0, num_frames, chunk_frames):
+        last = min(first + chunk_frames, num_frames)
+        samples = np.asarray(signal[first * hop:(last - 1) * hop + window_size], dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(samples, window_size)[::hop]
+        yield first, np.abs(np.fft.rfft(frames * window, axis=1)).astype(np.float32)
+
+def compute_spectrogram(
+    data: Union[str, np.ndarray],
+    window_size: int = 2048,
+    hop: int = 512,
+    sample_rate: int = SAMPLE_RATE,
+    output: Optional[str] = None,
+    silence: float = 1e-3,
+    max_columns: Optional[int] = None
+) -> dict:
+    """
+    Spectrogram of a capture and the loudest frequency of each frame, with its closest note.
+
+    Args:
+        data (str | np.ndarray): Path to a capture file or the signal itself.
+        window_size (int, optional): Length of the Hann window in samples. Defaults to 2048.
+        hop (int, optional): Samples between two windows. Defaults to 512.
+        output (str, optional): .npy file the spectrogram is written to as it is computed,
+            memory-mapped so that memory stays bounded whatever the length of the capture.
+        silence (float, optional): Peak amplitude under which a frame has no note. Defaults to 1e-3.
+        max_columns (int, optional): Without output, consecutive frames are max-pooled chunk by chunk down
+            to this many columns. If None, the full spectrogram goes to an anonymous temporary file.
+
+    Returns:
+        dict: spectrogram (columns, bins) magnitudes, pool the frames per column, times of the frame centers
+            and frequencies of the bins (in Hz), peak_frequencies (nan on silent frames), peak_notes and
+            peak_cents.
+    """
+    signal, sample_rate = _load_signal(data, sample_rate)
+    num_frames = max((len(signal) - window_size) // hop + 1, 0)
+    pool = 1
+    if output is None and max_columns is not None:
+        pool = max(-(-num_frames // max_columns), 1)
+    shape = (-(-num_frames // pool), window_size // 2 + 1)
+    if output is not None:
+        spectrogram = np.lib.format.open_memmap(output, mode="w+", dtype=np.float32, shape=shape)
+    elif pool > 1 or num_frames == 0:
+        spectrogram = np.zeros(shape, dtype=np.float32)
+    else:
+        # Deleted as soon as the array is garbage collected, only the pages in use stay in memory
+        spectrogram = np.memmap(tempfile.TemporaryFile(), mode="w+", dtype=np.float32, shape=shape)
+
+    peak_frequencies = np.full(num_frames, np.nan)
+    # Magnitude of a full-scale sine at the center of a bin, with the Hann window
+    full_scale = np.hanning(window_size).sum() / 2
+    for first, magnitudes in iter_stft(signal, window_size, hop):
+        if pool == 1:
+            spectrogram[first:first + len(magnitudes)] = magnitudes
+        else:
+            # Max of the frames of each column under the chunk, a column can span two chunks
+            starts = np.flatnonzero((first + np.arange(len(magnitudes))) % pool == 0)
+            starts = np.union1d(starts, [0])
+            columns = (first + starts) // pool
+            spectrogram[columns] = np.maximum(spectrogram[columns], np.maximum.reduceat(magnitudes, starts))
+        # Loudest bin, DC excluded, refined by a parabola through its neighbours
+        bins = np.argmax(magnitudes[:, 1:-1], axis=1) + 1
+        rows = np.arange(len(magnitudes))
+        left, center, right = (np.log(magnitudes[rows, bins + k] + 1e-12) for k in (-1, 0, 1))
+        offset = np.clip(0.5 * (left - right) / np.minimum(left - 2 * center + right, -1e-12), -0.5, 0.5)
+        loud = magnitudes[rows, bins] / full_scale >= silence
+        peaks = np.where(loud, (bins + offset) * sample_rate / window_size, np.nan)
+        peak_frequencies[first:first + len(magnitudes)] = peaks
+    if output is not None:
+        spectrogram.flush()
+
+    voiced = ~np.isnan(peak_frequencies)
+    peak_notes = np.full(num_frames, "", dtype="<U4")
+    peak_cents = np.full(num_frames, np.nan)
+    if voiced.any():
+        peak_notes[voiced] = closest_note(peak_frequencies[voiced])
+        peak_cents[voiced] = cents_error(peak_frequencies[voiced])
+    return {
+        "spectrogram": spectrogram,
+        "pool": pool,
+        "times": (np.arange(num_frames) * hop + window_size / 2) / sample_rate,
+        "frequencies": np.fft.rfftfreq(window_size, d=1 / sample_rate),
+        "peak_frequencies": peak_frequencies,
+        "peak_notes": peak_notes,
+        "peak_cents": peak_cents,
+    }
+
+def note_timeline(analysis: dict) -> List[Tuple[float, float, str]]:
+    """
+    Consecutive frames with the same peak note merged into (start, end, note) segments, in seconds.
+    """
+    notes, times = analysis["peak_notes"], analysis["times"]
+    segments = []
+    for i, note in enumerate(notes):
+        if segments and segments[-1][2] == note:
+            segments[-1][1] = times[i]
+        else:
+            segments.append([times[i], times[i], note])
+    return [(start, end, note) for start, end, note in segments if note]
+
+def plot_spectrogram(
+    data: Union[str, np.ndarray, dict],
+    path: Optional[str] = None,
+    window_size: int = 2048,
+    hop: int = 512,
+    max_columns: int = 2000
+) -> dict:
+    """
+    Plots the spectrogram of a capture in dB, with the peak frequency of each frame.
+
+    Args:
+        data (str | np.ndarray | dict): Path to a capture file, the signal, or the result of compute_spectrogram.
+        path (str, optional): Image file (.png, .pdf...) the plot is saved to, without opening a window.
+            If it ends with .npy, only the spectrogram is written, matplotlib is not used.
+            If None, the plot is shown. Defaults to None.
+        max_columns (int, optional): Frames are max-pooled down to this many columns, while they are
+            computed when data is not an analysis already. Defaults to 2000.
+
+    Returns:
+        dict: the analysis computed by compute_spectrogram.
+    """
+    if isinstance(data, dict):
+        analysis = data
+    elif path is not None and path.endswith(".npy"):
+        return compute_spectrogram(data, window_size, hop, output=path)
+    else:
+        analysis = compute_spectrogram(data, window_size, hop, max_columns=max_columns)
+
+    spectrogram = analysis["spectrogram"]
+    pool = max(-(-len(spectrogram) // max_columns), 1)
+    columns = len(spectrogram) // pool
+    image = spectrogram[:columns * pool].reshape(columns, pool, -1).max(axis=1)
+    times = analysis["times"][::analysis.get("pool", 1)][:columns * pool:pool]
+
+    if path is None:
+        figure = plt.figure(figsize=(12, 6))
+    else:
+        # A figure without pyplot has no window, this works on a headless machine
+        from matplotlib.figure import Figure
+        figure = Figure(figsize=(12, 6))
+    axes = figure.add_subplot()
+    axes.pcolormesh(times, analysis["frequencies"], 20 * np.log10(image.T + 1e-9), shading="auto")
+    axes.plot(analysis["times"], analysis["peak_frequencies"], color="white", linewidth=0.8)
+    axes.set_title("Spectrogram and peak frequency")
+    axes.set_xlabel("Time (s)")
+    axes.set_ylabel("Frequency (Hz)")
+    if path is None:
+        plt.show()
+    else:
+        figure.savefig(path)
+    return analysis
+
+default_path = "data/waveform.npy"
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -103,8 +271,35 @@ if __name__ == "__main__":
         "path",
         nargs="?",
         default=default_path,
-        help="Specify the path of the json fil containing the audio sample"
+        help="Specify the path of the capture file containing the audio sample"
+    )
+    parser.add_argument(
+        "--convert",
+        action="store_true",
+        help="Convert a json capture to the binary format before plotting"
+    )
+    parser.add_argument(
+        "--stft",
+        action="store_true",
+        help="Chunked STFT analysis: spectrogram and peak note of each frame"
+    )
+    parser.add_argument("--window", type=int, default=2048, help="STFT window length in samples")
+    parser.add_argument("--hop", type=int, default=512, help="STFT hop in samples")
+    parser.add_argument(
+        "-o", "--output",
+        help="Saves the spectrogram as an image, or as an array if it ends with .npy, instead of showing it"
     )
     args = parser.parse_args()
-    plot_waveform(args.path, slice=[0, 2 * p.CHUNK_DURATION * SAMPLE_RATE])
-    plot_spectrum(args.path)
\ No newline at end of file
+    legacy_path = os.path.splitext(args.path)[0] + ".json"
+    if args.convert:
+        args.path = convert_json_capture(args.path)
+    elif not os.path.isfile(args.path) and os.path.isfile(legacy_path):
+        # Binary captures are not versioned, they are regenerated from the json one
+        args.path = convert_json_capture(legacy_path)
+    if args.stft:
+        analysis = plot_spectrogram(args.path, args.output, window_size=args.window, hop=args.hop)
+        for start, end, note in note_timeline(analysis):
+            print(f"{start:8.2f} s - {end:8.2f} s  {note}")
+    else:
+        plot_waveform(args.path, slice=[0, 2 * p.CHUNK_DURATION * SAMPLE_RATE])
+        plot_spectrum(args.path)
\ No newline at end of file
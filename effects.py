@@ -0,0 +1,91 @@
+import numpy as np
+
+from utils import DTYPE, SAMPLE_RATE
+
+
+class Chorus():
+    '''
+    Streaming chorus / flanger built on a circular fractional delay line.
+    The output at input time j reads the input at j + depth * sin(2 pi rate j), between two
+    samples with linear interpolation, as synthesis.apply_chorus_effect does on a whole signal.
+    Reading up to depth ahead requires a constant latency of depth: each block outputs the
+    chorus of the input received latency samples earlier, and flush returns the last ones.
+    The LFO phase and the last 2 * depth samples are kept between blocks, so memory is
+    O(blocksize + depth). A small depth (a few ms) and a dry / wet mix give a flanger.
+    Samples are stored in utils.DTYPE, read positions and the LFO phase in float64.
+    '''
+
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        depth: float = 0.02,
+        rate: float = 1.5,
+        mix: float = 1.0
+    ):
+        '''
+        depth is in seconds, rate in Hz, mix is the proportion of modulated signal in the output.
+        '''
+        self.depth = depth * sample_rate  # In samples
+        self.latency = int(np.ceil(self.depth))
+        self.increment = 2 * np.pi * rate / sample_rate
+        self.mix = mix
+        self.reset()
+
+    def reset(self) -> None:
+        self.buffer = np.zeros(0, dtype=DTYPE)
+        self.lfo_phase = 0.0
+        self.written = 0  # Input samples received
+        self.emitted = 0  # Output samples returned
+
+    def _reserve(self, frames: int) -> None:
+        '''
+        Grows the delay line so that it holds a block and the 2 * depth samples read around it.
+        '''
+        size = frames + 2 * self.latency + 2
+        if len(self.buffer) >= size:
+            return
+        buffer = np.zeros(size, dtype=DTYPE)
+        kept = np.arange(max(self.written - len(self.buffer), 0), self.written)
+        if len(self.buffer) > 0:
+            buffer[kept % size] = self.buffer[kept % len(self.buffer)]
+        self.buffer = buffer
+
+    def _read(self, frames: int) -> np.ndarray:
+        out = np.zeros(frames, dtype=DTYPE)
+        # The first latency outputs come before the first input sample
+        first = min(max(self.latency - self.emitted, 0), frames)
+        times = self.emitted - self.latency + np.arange(first, frames)
+
+        phases = self.lfo_phase + self.increment * np.arange(len(times))
+        self.lfo_phase = (self.lfo_phase + self.increment * len(times)) % (2 * np.pi)
+        # Reads outside of the received signal are clamped to its first and last samples
+        positions = np.clip(times + self.depth * np.sin(phases), 0, self.written - 1)
+        left = np.floor(positions).astype(int)
+        right = np.minimum(left + 1, self.written - 1)
+        fraction = np.subtract(positions, left, out=np.empty(len(positions), dtype=DTYPE))
+
+        size = len(self.buffer)
+        left_values = self.buffer[left % size]
+        wet = left_values + fraction * (self.buffer[right % size] - left_values)
+        if self.mix == 1.0:
+            out[first:] = wet
+        else:
+            out[first:] = self.mix * wet + (1 - self.mix) * self.buffer[times % size]
+        self.emitted += frames
+        return out
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        '''
+        Feeds a block and returns as many output samples, delayed by latency.
+        '''
+        self._reserve(len(block))
+        size = len(self.buffer)
+        self.buffer[(self.written + np.arange(len(block))) % size] = block
+        self.written += len(block)
+        return self._read(len(block))
+
+    def flush(self) -> np.ndarray:
+        '''
+        Returns the last latency output samples, once the whole signal has been fed.
+        '''
+        return self._read(self.latency)
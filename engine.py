@@ -0,0 +1,100 @@
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+import parameters as p
+from utils import DTYPE, SAMPLE_RATE
+
+
+class OscillatorState(NamedTuple):
+    '''
+    Parameters of one oscillator, immutable so that a snapshot can be shared between threads.
+    '''
+    frequency: float
+    amplitude: float = 1.0
+    active: bool = True
+
+
+Snapshot = Tuple[OscillatorState, ...]
+
+
+class OscillatorEngine():
+    '''
+    Continuously running bank of oscillators controlled by parameter snapshots.
+    The GUI publishes a new immutable snapshot on every change, replacing a single reference,
+    and the audio thread reads that reference once per block: neither side takes a lock,
+    so dragging a slider never blocks the audio path.
+    Each block moves the rendered parameters towards the snapshot (one-pole smoothing with
+    time constant smoothing) and ramps them sample by sample over the block, so there is no zipper noise.
+    '''
+
+    def __init__(
+        self,
+        snapshot: Snapshot,
+        harmonics: List[float] = p.HARMONICS,
+        smoothing: float = p.SMOOTHING,
+        gain: float = p.AMPLITUDE,
+        sample_rate: int = SAMPLE_RATE
+    ):
+        self.snapshot = tuple(snapshot)
+        self.sample_rate = sample_rate
+        self.smoothing = smoothing
+        # Oscillators share the gain, so that the mix never exceeds it
+        self.gain = gain / max(len(self.snapshot), 1)
+        self.harmonics = np.asarray(harmonics, dtype=DTYPE) / float(np.sum(np.abs(harmonics)))
+        self.orders = np.arange(1, len(self.harmonics) + 1)
+
+        # Rendered state, at the end of the last block
+        frequencies, gains = self._targets(self.snapshot)
+        self.log_frequencies = np.log2(frequencies)
+        self.gains = gains
+        self.phases = np.zeros(len(self.snapshot))
+
+    def publish(self, snapshot: Snapshot) -> None:
+        '''
+        Called from the GUI thread, the new snapshot is rendered from the next block.
+        '''
+        snapshot = tuple(snapshot)
+        if len(snapshot) != len(self.phases):
+            raise ValueError("A snapshot should have one state per oscillator.")
+        self.snapshot = snapshot
+
+    @staticmethod
+    def _targets(snapshot: Snapshot) -> Tuple[np.ndarray, np.ndarray]:
+        frequencies = np.array([state.frequency for state in snapshot], dtype=float)
+        gains = np.array([state.amplitude if state.active else 0.0 for state in snapshot])
+        return frequencies, gains
+
+    def render_into(self, out: np.ndarray) -> None:
+        frames = len(out)
+        frequencies, gains = self._targets(self.snapshot)  # Single read of the published reference
+
+        # Parameters at the end of this block, frequencies are smoothed on a log scale
+        coefficient = 1 - np.exp(-frames / self.sample_rate / self.smoothing) if self.smoothing > 0 else 1.0
+        end_log_frequencies = self.log_frequencies + coefficient * (np.log2(frequencies) - self.log_frequencies)
+        end_gains = self.gains + coefficient * (gains - self.gains)
+
+        # Linear ramps over the block, the phase integrates the frequency ramp in closed form
+        start_frequencies = 2 ** self.log_frequencies[:, None]
+        slopes = (2 ** end_log_frequencies[:, None] - start_frequencies) / frames
+        n = np.arange(frames)
+        cycles = (start_frequencies * n + slopes * n * (n - 1) / 2) / self.sample_rate
+        phases = self.phases[:, None] + 2 * np.pi * cycles
+        # Phases are in float64, the waves and gain ramps are written in the sample type
+        ramps = np.empty(phases.shape, dtype=DTYPE)
+        np.add(self.gains[:, None], (end_gains - self.gains)[:, None] * n / frames, out=ramps)
+
+        waves = np.empty((len(phases), len(self.orders), frames), dtype=DTYPE)
+        np.sin(self.orders[None, :, None] * phases[:, None, :], out=waves)
+        signal = np.einsum("h,ohf,of->f", self.harmonics, waves, ramps)
+        np.multiply(signal, self.gain, out=out)
+
+        last_frequencies = start_frequencies[:, 0] + slopes[:, 0] * (frames - 1)
+        self.phases = (phases[:, -1] + 2 * np.pi / self.sample_rate * last_frequencies) % (2 * np.pi)
+        self.log_frequencies = end_log_frequencies
+        self.gains = end_gains
+
+    def render(self, frames: int) -> np.ndarray:
+        signal = np.empty(frames, dtype=DTYPE)
+        self.render_into(signal)
+        return signal
@@ -0,0 +1,155 @@
+from typing import Optional
+
+import numpy as np
+
+from utils import DTYPE, SAMPLE_RATE
+
+
+class ADSREnvelope():
+    '''
+    Streaming attack / decay / sustain / release envelope.
+    The level is a closed form of the position since note-on and, once released, of the
+    position since note-off, so a block is evaluated from a handful of numbers
+    (position, release position, release level) without building the whole note.
+
+    The same object holds the settings shared by the voices of a VoicePool, which keeps
+    the per-voice state in its own arrays and calls evaluate_into, and the state of a single
+    note for render.
+    '''
+
+    def __init__(
+        self,
+        attack: float,
+        decay: float,
+        sustain: float,
+        release: float,
+        sample_rate: int = SAMPLE_RATE
+    ):
+        '''
+        attack, decay and release are durations in seconds, sustain is a level between 0 and 1.
+        '''
+        if not 0 <= sustain <= 1:
+            raise ValueError("Sustain level should be between 0 and 1.")
+        # Stages last at least one sample so that the slopes stay finite
+        self.attack = max(int(attack * sample_rate), 1)
+        self.decay = max(int(decay * sample_rate), 1)
+        self.sustain = sustain
+        self.release = max(int(release * sample_rate), 1)
+        self.sample_rate = sample_rate
+
+        # State of a single note, see note_on / note_off / render
+        self.position = 0
+        self.release_position = None
+        self.release_level = 0.0
+        self.active = False
+
+    def level_at(self, position: int) -> float:
+        '''
+        Level of a note that has not been released, position samples after note-on.
+        '''
+        if position < self.attack:
+            return position / self.attack
+        return 1 - (1 - self.sustain) * min((position - self.attack) / self.decay, 1.0)
+
+    def is_finished(self, position: int, release_position: Optional[int]) -> bool:
+        '''
+        True once the note has faded out, either after its release or when sustain is 0.
+        '''
+        if release_position is not None and position >= release_position:
+            return position - release_position >= self.release
+        return self.sustain == 0 and position >= self.attack + self.decay
+
+    def evaluate_into(
+        self,
+        positions: np.ndarray,
+        release_offsets: np.ndarray,
+        release_levels: np.ndarray,
+        out: np.ndarray,
+        scratch: np.ndarray,
+        released: np.ndarray
+    ) -> None:
+        '''
+        Evaluates the envelope of several notes for one block, without allocating.
+
+        Args:
+            positions (np.ndarray): (notes, frames) samples since note-on.
+            release_offsets (np.ndarray): (notes, frames) samples since note-off, negative before it.
+                Overwritten, it is reused as a scratch buffer.
+            release_levels (np.ndarray): (notes, 1, 1) level of each note when it is released.
+            out (np.ndarray): (notes, frames) output levels.
+            scratch (np.ndarray): (notes, frames) float buffer.
+            All the float arrays should have the same dtype (utils.DTYPE) for the evaluation to be in place.
+            released (np.ndarray): (notes, frames) bool buffer.
+        '''
+        # Attack and decay: min(rising slope, falling slope held at the sustain level)
+        np.divide(positions, self.attack, out=out)
+        np.subtract(positions, self.attack, out=scratch)
+        np.divide(scratch, self.decay, out=scratch)
+        np.clip(scratch, 0, 1, out=scratch)
+        np.multiply(scratch, self.sustain - 1, out=scratch)
+        np.add(scratch, 1, out=scratch)
+        np.minimum(out, scratch, out=out)
+
+        # Release: linear fade from the level reached at note-off
+        np.divide(release_offsets, -self.release, out=scratch)
+        np.add(scratch, 1, out=scratch)
+        np.clip(scratch, 0, 1, out=scratch)
+        # Row scaling through matmul, a broadcast multiply would allocate
+        np.matmul(release_levels, scratch[:, None, :], out=release_offsets[:, None, :])
+        np.greater_equal(scratch, 1, out=released)
+        np.logical_not(released, out=released)
+        np.copyto(out, release_offsets, where=released)
+
+    def note_on(self) -> None:
+        self.position = 0
+        self.release_position = None
+        self.release_level = 0.0
+        self.active = True
+
+    def note_off(self, delay: float = 0.0) -> None:
+        '''
+        Starts the release now, or delay seconds from now. A release already scheduled later
+        is moved earlier, as VoicePool.note_off does, a release that has started is kept.
+        '''
+        release_position = self.position + int(delay * self.sample_rate)
+        if not self.active or (self.release_position is not None and self.release_position <= release_position):
+            return
+        self.release_position = release_position
+        self.release_level = self.level_at(self.release_position)
+
+    @property
+    def stage(self) -> str:
+        if not self.active:
+            return "idle"
+        if self.release_position is not None and self.position >= self.release_position:
+            return "release"
+        if self.position < self.attack:
+            return "attack"
+        if self.position < self.attack + self.decay:
+            return "decay"
+        return "sustain"
+
+    def render(self, frames: int) -> np.ndarray:
+        '''
+        Returns the next frames of the envelope of the current note and moves forward.
+        '''
+        if not self.active:
+            return np.zeros(frames, dtype=DTYPE)
+        positions = (self.position + np.arange(frames, dtype=DTYPE))[None, :]
+        if self.release_position is None:
+            release_offsets = np.full((1, frames), -1.0, dtype=DTYPE)
+        else:
+            release_offsets = positions - self.release_position
+        out = np.empty((1, frames), dtype=DTYPE)
+        self.evaluate_into(
+            positions,
+            release_offsets,
+            np.array([[[self.release_level]]], dtype=DTYPE),
+            out,
+            np.empty((1, frames), dtype=DTYPE),
+            np.empty((1, frames), dtype=bool)
+        )
+        self.position += frames
+        if self.is_finished(self.position, self.release_position):
+            self.active = False
+        return out[0]
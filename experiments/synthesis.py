@@ -5,6 +5,7 @@ import numpy as np
 import sounddevice as sd
 
 from oscillator import Oscillator
+from synthesis import generate_tone
 from utils import SAMPLE_RATE, NOTE_FREQUENCIES
 
 class Synthesis():
@@ -18,8 +19,14 @@ class Synthesis():
         self.stop_thread = False
 
     def computeSignal(self):
-        for oscillator in self.lOscillators:
-            self.signal += oscillator.amplitude * np.sin(2 * np.pi * oscillator.frequency * self.t)
+        signal, _ = generate_tone(
+            [oscillator.frequency for oscillator in self.lOscillators],
+            self.duration,
+            sample_rate=SAMPLE_RATE,
+            amplitudes=[oscillator.amplitude for oscillator in self.lOscillators],
+            normalize=False
+        )
+        self.signal += signal
         #TODO : normaliser ?
     
     def playSignal(self):
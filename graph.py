@@ -0,0 +1,231 @@
+from typing import List, Optional
+
+import numpy as np
+
+import parameters as p
+from effects import Chorus
+from envelope import ADSREnvelope
+from synthesis import generate_tone
+from utils import DTYPE, SAMPLE_RATE
+from voices import VoicePool
+
+
+class Node():
+    '''
+    Block processor of an AudioGraph: process writes one block into out from the blocks of its inputs.
+    Nodes keep their own state (phases, envelope positions, delay lines) between blocks.
+    '''
+
+    def __init__(self, *inputs: "Node"):
+        self.inputs = list(inputs)
+
+    def prepare(self, frames: int) -> None:
+        '''
+        Allocates what process needs for this block size, before the stream starts.
+        '''
+
+    def process(self, inputs: List[np.ndarray], out: np.ndarray) -> None:
+        raise NotImplementedError
+
+
+class VoicePoolNode(Node):
+    '''
+    Mix of the active voices of a VoicePool, notes are started and released on the pool.
+    '''
+
+    def __init__(self, pool: VoicePool):
+        super().__init__()
+        self.pool = pool
+
+    def prepare(self, frames: int) -> None:
+        self.pool.prepare(frames)
+
+    def process(self, inputs, out):
+        self.pool.render_into(out)
+
+
+class OscillatorNode(Node):
+    '''
+    Fixed set of voices rendered with generate_tone, phases continue from block to block.
+    '''
+
+    def __init__(
+        self,
+        frequencies: List[float],
+        harmonics: List[float] = p.HARMONICS,
+        waveform: str = p.WAVEFORM,
+        backend: str = "direct",
+        amplitudes: Optional[List[float]] = None,
+        initial_phases: Optional[np.ndarray] = None,
+        sample_rate: int = SAMPLE_RATE
+    ):
+        super().__init__()
+        self.frequencies = np.atleast_1d(np.asarray(frequencies, dtype=float))
+        self.harmonics = harmonics
+        self.waveform = waveform
+        self.backend = backend
+        self.amplitudes = amplitudes
+        self.sample_rate = sample_rate
+        if initial_phases is None:
+            initial_phases = np.zeros((len(self.frequencies), len(harmonics)))
+        self.phases = np.asarray(initial_phases, dtype=float)
+
+    def process(self, inputs, out):
+        signal, self.phases = generate_tone(
+            self.frequencies,
+            len(out) / self.sample_rate,
+            sample_rate=self.sample_rate,
+            initial_phases=self.phases,
+            waveform=self.waveform,
+            harmonics=self.harmonics,
+            backend=self.backend,
+            amplitudes=self.amplitudes,
+            normalize=False
+        )
+        np.copyto(out, signal)
+
+
+class EnvelopeNode(Node):
+    '''
+    Applies the note of an ADSREnvelope (see note_on / note_off) to its input.
+    '''
+
+    def __init__(self, source: Node, envelope: ADSREnvelope):
+        super().__init__(source)
+        self.envelope = envelope
+
+    def process(self, inputs, out):
+        np.multiply(inputs[0], self.envelope.render(len(out)), out=out)
+
+
+class MixerNode(Node):
+    '''
+    Weighted sum of its inputs.
+    '''
+
+    def __init__(self, *sources: Node, gains: Optional[List[float]] = None):
+        super().__init__(*sources)
+        self.gains = [1.0] * len(sources) if gains is None else list(gains)
+
+    def process(self, inputs, out):
+        np.multiply(inputs[0], self.gains[0], out=out)
+        for signal, gain in zip(inputs[1:], self.gains[1:]):
+            out += gain * signal
+
+
+class ChorusNode(Node):
+    '''
+    Streaming chorus, its output is delayed by chorus.latency samples.
+    '''
+
+    def __init__(self, source: Node, chorus: Optional[Chorus] = None):
+        super().__init__(source)
+        self.chorus = Chorus() if chorus is None else chorus
+
+    def process(self, inputs, out):
+        np.copyto(out, self.chorus.process(inputs[0]))
+
+
+class GainNode(Node):
+    def __init__(self, source: Node, gain: float = p.AMPLITUDE):
+        super().__init__(source)
+        self.gain = gain
+
+    def process(self, inputs, out):
+        np.multiply(inputs[0], self.gain, out=out)
+
+
+class AudioGraph():
+    '''
+    Nodes connected once and pulled block by block from the output node.
+    The nodes are scheduled in topological order, and each intermediate block is written into
+    a buffer of a pool that is reused as soon as the last node reading it has run,
+    so the graph needs as many buffers as blocks alive at the same time, not one per edge.
+    '''
+
+    def __init__(self, output: Node):
+        self.output = output
+        self.order = self._schedule(output)
+        self.slots, self.num_buffers = self._assign_buffers(self.order)
+        self._plans = {}  # Buffers and processing order, by block size
+
+    @staticmethod
+    def _schedule(output: Node) -> List[Node]:
+        '''
+        Nodes in the order they are processed, each one after its inputs.
+        '''
+        order = []
+        visited = set()
+
+        def visit(node, path):
+            if id(node) in path:
+                raise ValueError("The audio graph contains a cycle.")
+            if id(node) in visited:
+                return
+            for source in node.inputs:
+                visit(source, path | {id(node)})
+            visited.add(id(node))
+            order.append(node)
+
+        visit(output, set())
+        return order
+
+    @staticmethod
+    def _assign_buffers(order: List[Node]):
+        '''
+        Pool slot of the output of each node but the last one, which writes into the caller buffer.
+        A slot is freed after the last node reading it, then reused by the next node.
+        '''
+        last_use = {}
+        for step, node in enumerate(order):
+            for source in node.inputs:
+                last_use[id(source)] = step
+
+        slots = {}
+        free = []
+        num_buffers = 0
+        for step, node in enumerate(order[:-1]):
+            # A node never writes into one of its own inputs
+            if free:
+                slots[id(node)] = free.pop()
+            else:
+                slots[id(node)] = num_buffers
+                num_buffers += 1
+            for source in set(map(id, node.inputs)):
+                if last_use[source] == step:
+                    free.append(slots[source])
+        return slots, num_buffers
+
+    def prepare(self, frames: int) -> List[tuple]:
+        '''
+        Returns the plan for this block size: (node, input blocks, output block or None for the
+        caller buffer) in processing order. The buffer pool is allocated and the nodes are
+        prepared on first use, so that pulling a block allocates nothing in the graph itself.
+        '''
+        plan = self._plans.get(frames)
+        if plan is None:
+            buffers = [np.zeros(frames, dtype=DTYPE) for _ in range(self.num_buffers)]
+            plan = [
+                (
+                    node,
+                    [buffers[self.slots[id(source)]] for source in node.inputs],
+                    None if node is self.output else buffers[self.slots[id(node)]]
+                )
+                for node in self.order
+            ]
+            self._plans[frames] = plan
+            for node in self.order:
+                node.prepare(frames)
+        return plan
+
+    def render_into(self, out: np.ndarray) -> None:
+        '''
+        Pulls one block from the output node into out (e.g. the outdata of the stream).
+        '''
+        for node, inputs, target in self.prepare(len(out)):
+            node.process(inputs, out if target is None else target)
+
+    def render(self, frames: int) -> np.ndarray:
+        signal = np.empty(frames, dtype=DTYPE)
+        self.render_into(signal)
+        return signal
@@ -0,0 +1,157 @@
+import struct
+from typing import Tuple
+
+import numpy as np
+
+from utils import SAMPLE_RATE
+
+# Standard MIDI files (format 0 and 1) read into a table of note events, one row per note-on or note-off,
+# indexed by sample so that a renderer only compares integers
+
+NOTE_OFF = 0
+NOTE_ON = 1
+
+EVENT_DTYPE = np.dtype([
+    ("sample", "<i8"),  # Time of the event in samples
+    ("kind", "u1"),  # NOTE_OFF or NOTE_ON
+    ("channel", "u1"),
+    ("note", "u1"),  # MIDI number, see pitch.midi_to_frequency
+    ("velocity", "u1"),
+    ("track", "<u2"),
+])
+
+DEFAULT_TEMPO = 500000  # Microseconds per quarter note, 120 bpm
+DRUM_CHANNEL = 9  # General MIDI percussion, channel 10 counting from 1
+# Data bytes of the channel messages, by status high nibble
+_DATA_BYTES = {0x8: 2, 0x9: 2, 0xA: 2, 0xB: 2, 0xC: 1, 0xD: 1, 0xE: 2}
+
+
+def _read_varlen(data: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+def _parse_track(data: bytes, track: int, notes: list, tempos: list) -> None:
+    '''
+    Appends (tick, kind, channel, note, velocity, track) note events and (tick, tempo) changes.
+    '''
+    pos = 0
+    tick = 0
+    status = 0
+    while pos < len(data):
+        delta, pos = _read_varlen(data, pos)
+        tick += delta
+        if data[pos] & 0x80:
+            status = data[pos]
+            pos += 1
+        elif status == 0:
+            raise ValueError("Invalid MIDI file: running status without a previous status byte.")
+
+        if status == 0xFF:
+            meta = data[pos]
+            length, pos = _read_varlen(data, pos + 1)
+            if meta == 0x51 and length == 3:
+                tempos.append((tick, int.from_bytes(data[pos:pos + 3], "big")))
+            elif meta == 0x2F:
+                return
+            pos += length
+            status = 0  # Meta and sysex events cancel the running status
+        elif status in (0xF0, 0xF7):
+            length, pos = _read_varlen(data, pos)
+            pos += length
+            status = 0
+        else:
+            kind = status >> 4
+            if kind not in _DATA_BYTES:
+                raise ValueError(f"Invalid MIDI file: unexpected status byte {status:#x}.")
+            args = data[pos:pos + _DATA_BYTES[kind]]
+            pos += _DATA_BYTES[kind]
+            if kind == 0x9 and args[1] > 0:
+                notes.append((tick, NOTE_ON, status & 0x0F, args[0], args[1], track))
+            elif kind in (0x8, 0x9):
+                # A note-on of velocity 0 is a note-off
+                notes.append((tick, NOTE_OFF, status & 0x0F, args[0], 0, track))
+
+def ticks_to_seconds(ticks: np.ndarray, tempos: np.ndarray, division: int) -> np.ndarray:
+    '''
+    Converts ticks to seconds through the tempo map, tempos being sorted (tick, microseconds per quarter) rows.
+    '''
+    if len(tempos) == 0 or tempos[0, 0] > 0:
+        tempos = np.vstack(([[0, DEFAULT_TEMPO]], tempos.reshape(-1, 2)))
+    seconds_per_tick = tempos[:, 1] / 1e6 / division
+    # Time of each tempo change
+    starts = np.concatenate(([0.0], np.cumsum(np.diff(tempos[:, 0]) * seconds_per_tick[:-1])))
+    segment = np.searchsorted(tempos[:, 0], ticks, side="right") - 1
+    return starts[segment] + (ticks - tempos[segment, 0]) * seconds_per_tick[segment]
+
+def read_midi(path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    '''
+    Reads the note events of every track of a standard MIDI file.
+
+    Args:
+        path (str): .mid file.
+        sample_rate (int, optional): Sample rate the event times are converted to. Defaults to SAMPLE_RATE.
+
+    Returns:
+        np.ndarray: EVENT_DTYPE structured array sorted by sample, note-offs before note-ons at the same sample.
+    '''
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if data[:4] != b"MThd":
+        raise ValueError(f"Not a standard MIDI file: {path}")
+    header_length, _, num_tracks, division = struct.unpack(">IHHH", data[4:14])
+    if division & 0x8000:
+        # SMPTE time: frames per second (negative, two's complement) and ticks per frame
+        ticks_per_second = (256 - (division >> 8)) * (division & 0xFF)
+        division = None
+    pos = 8 + header_length
+
+    notes, tempos = [], []
+    for track in range(num_tracks):
+        while data[pos:pos + 4] != b"MTrk":
+            # Unknown chunks are skipped
+            length = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+            pos += 8 + length
+        length = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        _parse_track(data[pos + 8:pos + 8 + length], track, notes, tempos)
+        pos += 8 + length
+
+    events = np.zeros(len(notes), dtype=EVENT_DTYPE)
+    if len(notes) == 0:
+        return events
+    table = np.array(notes, dtype=np.int64)
+    if division is None:
+        seconds = table[:, 0] / ticks_per_second
+    else:
+        tempo_map = np.array(sorted(tempos, key=lambda tempo: tempo[0]), dtype=np.int64).reshape(-1, 2)
+        seconds = ticks_to_seconds(table[:, 0], tempo_map, division)
+    events["sample"] = np.round(seconds * sample_rate)
+    for column, name in enumerate(EVENT_DTYPE.names[1:], start=1):
+        events[name] = table[:, column]
+    return events[np.lexsort((events["kind"], events["sample"]))]
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    # Imported here, render depends on this module
+    from render import render_events
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="Standard MIDI file")
+    parser.add_argument("-o", "--output", default="song.wav", help="Path of the wav file")
+    parser.add_argument("--blocksize", type=int, default=1024, help="Frames rendered per block")
+    parser.add_argument("--tuning", default="equal", help="Tuning of the notes, see pitch.TUNINGS")
+    args = parser.parse_args()
+
+    events = read_midi(args.path)
+    start = time.perf_counter()
+    stats = render_events(events, args.output, blocksize=args.blocksize, tuning=args.tuning)
+    elapsed = time.perf_counter() - start
+    duration = stats["frames"] / SAMPLE_RATE
+    print(f"{len(events)} events, {duration:.1f} s rendered in {elapsed:.1f} s ({duration / elapsed:.0f}x real time)")
+    print(f"Peak {stats['peak']:.2f}, {stats['clipped']} clipped samples")
@@ -1,18 +1,20 @@
-import numpy as np
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QSlider, QCheckBox, QLabel, QPushButton
 
+import pitch
 import utils
+from engine import OscillatorState
 
 class Oscillator():
 
     MIN_FREQUENCY = 16
     MAX_FREQUENCY = 7100
 
-    def __init__(self, frequency, amplitude=1, label="", isActivated=True):
+    def __init__(self, frequency, amplitude=1, label="", isActivated=True, onChange=None):
         self.frequency = frequency
         self.amplitude = amplitude
         self.label = label
         self.isActivated = isActivated
+        self.onChange = onChange  # Called after every parameter change, e.g. to publish a snapshot to the engine
 
         # UI
         self.slider_label = QLabel(self.label)
@@ -47,11 +49,23 @@ class Oscillator():
         else:
             print("Activating")
             self.isActivated = True
+        self.notify()
 
     def slider_changed(self):
         self.frequency = self.sliderValueToFrequency(self.slider.value())
         self.slider_frequency_value_label.setText(f"Frequency: {int(self.frequency)} Hz")
         self.slider_note_value_label.setText(f"Note: {utils.getClosestNote(self.frequency)}")
+        self.notify()
+
+    def notify(self):
+        if self.onChange is not None:
+            self.onChange()
+
+    def state(self):
+        '''
+        Immutable copy of the sound parameters, read by the audio engine.
+        '''
+        return OscillatorState(float(self.frequency), float(self.amplitude), self.isActivated)
 
     def octaveChange(self, delta):
         # Change slider position with new octave
@@ -70,7 +84,7 @@ class Oscillator():
         self.adjust_slider_value(step)
 
     def noteChange(self, delta):
-        note = utils.getNoteFromFrequency(utils.getClosestNote(self.frequency))
+        note = utils.getNoteFromFrequency(self.frequency)
         # if delta > 0:
         #     aboveNote = 
 
@@ -83,19 +97,9 @@ class Oscillator():
         From 0 to 100 to min, max of frequencies
         Logarithmic scale
         '''
-        # Ensure the input value is within the [0, 100] range
-        normalized_value = max(0, min(100, value))
-
-        # Map to the logarithmic scale
-        mapped_value = 10 ** (np.log10(self.MIN_FREQUENCY) + normalized_value * (np.log10(self.MAX_FREQUENCY) - np.log10(self.MIN_FREQUENCY)) / 100)
-
-        return mapped_value
+        return pitch.slider_to_frequency(value, self.MIN_FREQUENCY, self.MAX_FREQUENCY)
 
     def frequencyToSliderValue(self, frequency):
-
-        # Calculate the inverse mapping
-        inverse_mapped_value = ((np.log10(frequency) - np.log10(self.MIN_FREQUENCY)) / (np.log10(self.MAX_FREQUENCY) - np.log10(self.MIN_FREQUENCY))) * 100
-
-        return inverse_mapped_value
+        return pitch.frequency_to_slider(frequency, self.MIN_FREQUENCY, self.MAX_FREQUENCY)
 
  
\ No newline at end of file
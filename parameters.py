@@ -1,12 +1,33 @@
+from utils import SAMPLE_RATE
+
 HARMONICS = [1.0, 0.5, 0.25, 0.125]
 
 CHUNK_DURATION = 0.05  # Duration of each chunk in seconds
 AMPLITUDE = 0.3  # Amplitude of the sine waves
 DURATION = 0.5 # Total duration for a note
+POLYPHONY = 32 # Maximum number of notes played at the same time
+RENDER_AHEAD = 0 # Blocks rendered in advance by a producer thread, 0 renders in the audio callback
+WORKERS = 0 # Processes sharing the voices of the keyboard, 0 renders them in the audio thread
+
+# Latency profiles of the keyboard stream: frames per block and sounddevice latency hint ("low", "high" or seconds)
+# From the lowest latency to the safest, a profile the machine cannot sustain falls back to the next one
+LATENCY_PROFILES = {
+    "low": {"blocksize": 128, "latency": "low"},
+    "balanced": {"blocksize": 512, "latency": "low"},
+    "safe": {"blocksize": int(CHUNK_DURATION * SAMPLE_RATE), "latency": "high"},
+}
+LATENCY_PROFILE = "balanced"
+MAX_UTILIZATION = 0.5 # Share of the block duration the calibration render may use (99th percentile)
 
 # Envelope parameters
 ATTACK = 0.05 # in seconds
-DECAY = 0.3 # in seconds
+DECAY = 0.1 # in seconds
+SUSTAIN = 0.7 # level between 0 and 1
+RELEASE = 0.3 # in seconds, the release of a note starts RELEASE seconds before DURATION
+
+# Time constant of the smoothing of the GUI parameters, in seconds
+SMOOTHING = 0.02
 
-# Waveform can either be sinus, sawtooth or square
+# Waveform of the keyboard voices (voices.VoicePool, naive): sinus, sawtooth, square or triangle
+# synthesis.generate_tone also renders them band-limited with its wavetable, polyblep or ifft backend
 WAVEFORM = "sinus"
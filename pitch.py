@@ -0,0 +1,128 @@
+import re
+from typing import Dict, Union
+
+import numpy as np
+
+# Pitch arithmetic on MIDI note numbers: A4 = 69, one semitone = 1
+# Every function takes a scalar or a NumPy array and works element-wise
+
+REFERENCE_PITCH = 440.0  # Frequency of A4 in Hz
+A4 = 69
+C0 = 12  # Lowest note of utils.NOTE_FREQUENCIES
+A8 = 117  # Highest note of utils.NOTE_FREQUENCIES
+
+NOTE_NAMES = np.array(["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"])
+FLAT_NAMES = {"C#": "Db", "D#": "Eb", "F#": "Gb", "G#": "Ab", "A#": "Bb"}
+_NOTE_PATTERN = re.compile(r"^([A-G])([#b]?)(-?\d+)$")
+_PITCH_CLASSES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+
+# Tunings, in cents above C for each pitch class of the octave
+TUNINGS = {
+    "equal": 100.0 * np.arange(12),
+    "just": 1200 * np.log2([1, 16 / 15, 9 / 8, 6 / 5, 5 / 4, 4 / 3, 45 / 32, 3 / 2, 8 / 5, 5 / 3, 9 / 5, 15 / 8]),
+    "pythagorean": 1200 * np.log2([
+        1, 256 / 243, 9 / 8, 32 / 27, 81 / 64, 4 / 3, 729 / 512, 3 / 2, 128 / 81, 27 / 16, 16 / 9, 243 / 128
+    ]),
+}
+
+Number = Union[float, np.ndarray]
+
+
+def frequency_to_midi(frequency: Number, reference: float = REFERENCE_PITCH) -> Number:
+    '''
+    Fractional MIDI number of a frequency in equal temperament.
+    '''
+    return A4 + 12 * np.log2(np.asarray(frequency, dtype=float) / reference)
+
+def midi_to_frequency(midi: Number, reference: float = REFERENCE_PITCH, tuning: str = "equal") -> Number:
+    '''
+    Frequency of a MIDI number. A4 is at the reference pitch whatever the tuning.
+    '''
+    if tuning not in TUNINGS:
+        raise ValueError(f"Unsupported tuning. Choose among {', '.join(TUNINGS)}.")
+    midi = np.asarray(midi, dtype=float)
+    if tuning == "equal":
+        return reference * 2 ** ((midi - A4) / 12)
+    cents = TUNINGS[tuning]
+    octave, pitch_class = np.divmod(np.rint(midi).astype(int), 12)
+    offset = (midi - np.rint(midi)) * 100  # Fractional notes are tempered
+    # C of the octave of A4, so that A4 falls on the reference
+    c4 = reference / 2 ** (cents[A4 % 12] / 1200)
+    return c4 * 2 ** (octave - A4 // 12 + (cents[pitch_class] + offset) / 1200)
+
+def midi_to_note(midi: Number) -> Union[str, np.ndarray]:
+    '''
+    Name of the closest note, with sharps: 61 -> 'C#4'.
+    '''
+    midi = np.rint(np.asarray(midi)).astype(int)
+    octave, pitch_class = np.divmod(midi, 12)
+    names = np.char.add(NOTE_NAMES[pitch_class], (octave - 1).astype(str))
+    return names.item() if names.ndim == 0 else names
+
+def note_to_midi(note: str) -> int:
+    '''
+    MIDI number of a note name, with sharps or flats: 'Db4' -> 61.
+    '''
+    match = _NOTE_PATTERN.match(note)
+    if match is None:
+        raise ValueError(f"Invalid note name: {note}")
+    letter, accidental, octave = match.groups()
+    shift = {"#": 1, "b": -1}.get(accidental, 0)
+    return (int(octave) + 1) * 12 + _PITCH_CLASSES[letter] + shift
+
+def closest_midi(frequency: Number, reference: float = REFERENCE_PITCH) -> Number:
+    '''
+    MIDI number of the closest note, within the range of utils.NOTE_FREQUENCIES.
+    '''
+    return np.clip(np.rint(frequency_to_midi(frequency, reference)), C0, A8).astype(int)
+
+def closest_note(frequency: Number, reference: float = REFERENCE_PITCH) -> Union[str, np.ndarray]:
+    return midi_to_note(closest_midi(frequency, reference))
+
+def cents_error(frequency: Number, reference: float = REFERENCE_PITCH) -> Number:
+    '''
+    Distance in cents between a frequency and its closest note, in [-50, 50] within range.
+    '''
+    midi = frequency_to_midi(frequency, reference)
+    return 100 * (midi - closest_midi(frequency, reference))
+
+def rounding_error(frequency: Number, reference: float = REFERENCE_PITCH) -> Number:
+    '''
+    Distance in Hz between a frequency and its closest note, divided by the distance in Hz
+    between that note and the neighbour note on the same side.
+    '''
+    closest = closest_midi(frequency, reference)
+    closest_frequency = midi_to_frequency(closest, reference)
+    side = np.where(np.asarray(frequency) >= closest_frequency, 1, -1)
+    neighbour_frequency = midi_to_frequency(closest + side, reference)
+    return np.abs(frequency - closest_frequency) / np.abs(neighbour_frequency - closest_frequency)
+
+def slider_to_frequency(value: Number, min_frequency: float, max_frequency: float) -> Number:
+    '''
+    From 0 to 100 to min, max of frequencies, on a logarithmic scale.
+    '''
+    value = np.clip(value, 0, 100)
+    return min_frequency * (max_frequency / min_frequency) ** (value / 100)
+
+def frequency_to_slider(frequency: Number, min_frequency: float, max_frequency: float) -> Number:
+    return 100 * np.log(np.asarray(frequency) / min_frequency) / np.log(max_frequency / min_frequency)
+
+def note_table(
+    reference: float = REFERENCE_PITCH,
+    tuning: str = "equal",
+    lowest: int = C0,
+    highest: int = A8,
+    decimals: int = 2
+) -> Dict[str, float]:
+    '''
+    Note name -> frequency table, sharps and flats included (e.g. 'C#4' and 'Db4').
+    '''
+    midi = np.arange(lowest, highest + 1)
+    frequencies = np.round(midi_to_frequency(midi, reference, tuning), decimals)
+    table = {}
+    for note, frequency in zip(midi_to_note(midi), frequencies.tolist()):
+        table[note] = frequency
+        name = note.rstrip("-0123456789")
+        if name in FLAT_NAMES:
+            table[FLAT_NAMES[name] + note[len(name):]] = frequency
+    return table
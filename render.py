@@ -0,0 +1,220 @@
+import argparse
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+import parameters as p
+import pitch
+from chord_maker import chordFrequencies, decodeChordSequence
+from envelope import ADSREnvelope
+from graph import AudioGraph, EnvelopeNode, OscillatorNode, VoicePoolNode
+from midi import DRUM_CHANNEL, NOTE_ON
+from utils import DTYPE, SAMPLE_RATE
+from voices import VoicePool
+
+
+def _open_wav(path: str, sample_rate: int = SAMPLE_RATE) -> wave.Wave_write:
+    fp = wave.open(path, "wb")
+    fp.setnchannels(1)
+    fp.setsampwidth(2)
+    fp.setframerate(sample_rate)
+    return fp
+
+def _pcm(signal: np.ndarray) -> bytes:
+    return (np.clip(signal, -1, 1) * 32767).astype("<i2").tobytes()
+
+def write_wav(path: str, signal: np.ndarray, sample_rate: int = SAMPLE_RATE) -> None:
+    '''
+    Writes a mono signal in [-1, 1] as a 16 bits PCM wav file.
+    '''
+    with _open_wav(path, sample_rate) as fp:
+        fp.writeframes(_pcm(signal))
+
+def render_chord(
+    frequencies: Sequence[float],
+    start: int,
+    length: int,
+    envelope: ADSREnvelope,
+    harmonics: List[float] = p.HARMONICS,
+    waveform: str = p.WAVEFORM,
+    sample_rate: int = SAMPLE_RATE
+) -> np.ndarray:
+    '''
+    Renders one chord held for length samples, followed by its release tail.
+    Phases are those of oscillators started at sample 0, so a note held over several
+    chords is continuous once the chords are stitched at their start sample.
+    '''
+    frequencies = np.asarray(frequencies, dtype=float)
+    orders = np.arange(1, len(harmonics) + 1)
+    initial_phases = (2 * np.pi * frequencies[:, None] * orders * start / sample_rate) % (2 * np.pi)
+
+    oscillator = OscillatorNode(
+        frequencies,
+        harmonics=harmonics,
+        waveform=waveform,
+        amplitudes=np.full(len(frequencies), 1 / len(frequencies)),
+        initial_phases=initial_phases,
+        sample_rate=sample_rate
+    )
+    engine = AudioGraph(EnvelopeNode(oscillator, envelope))
+    envelope.note_on()
+    envelope.note_off(delay=length / sample_rate)
+    # Offline, the whole chord is pulled as a single block
+    return engine.render(length + envelope.release)
+
+def _render_chord_task(task: Tuple) -> np.ndarray:
+    return render_chord(*task)
+
+def render_chord_sequence(
+    chords: Union[str, Sequence[str]],
+    path: Optional[str] = None,
+    tempo: float = 120,
+    beats: Union[float, Sequence[float]] = 4,
+    envelope: Optional[ADSREnvelope] = None,
+    harmonics: List[float] = p.HARMONICS,
+    waveform: str = p.WAVEFORM,
+    sample_rate: int = SAMPLE_RATE,
+    workers: Optional[int] = None
+) -> np.ndarray:
+    '''
+    Renders a chord progression faster than real time and writes it as a wav file.
+
+    Args:
+        chords (str | Sequence[str]): chord symbols understood by chord_maker.buildChord, or a
+            progression string for chord_maker.decodeChordSequence ("Gmin F6:2 ...").
+        path (str, optional): wav file to write. Defaults to None (nothing is written).
+        tempo (float, optional): beats per minute. Defaults to 120.
+        beats (float | Sequence[float], optional): duration of every chord, or of each chord, in beats.
+        envelope (ADSREnvelope, optional): envelope of each chord. Defaults to the parameters envelope.
+        workers (int, optional): size of the process pool, one per core by default.
+
+    Returns:
+        np.ndarray: the rendered signal, chords are rendered in parallel then overlap-added.
+    '''
+    if envelope is None:
+        envelope = ADSREnvelope(p.ATTACK, p.DECAY, p.SUSTAIN, p.RELEASE, sample_rate=sample_rate)
+    if isinstance(chords, str):
+        events = list(decodeChordSequence(chords, tempo=tempo, beats=beats, sample_rate=sample_rate))
+    else:
+        if np.ndim(beats) == 0:
+            beats = [beats] * len(chords)
+        starts = np.round(np.concatenate(([0], np.cumsum(beats))) * 60 / tempo * sample_rate).astype(int)
+        events = [(start, chordFrequencies(chord)) for start, chord in zip(starts, chords)]
+        events.append((starts[-1], np.array([])))
+
+    # Each chord lasts until the next event
+    tasks = [
+        (frequencies, int(start), int(end - start), envelope, harmonics, waveform, sample_rate)
+        for (start, frequencies), (end, _) in zip(events[:-1], events[1:])
+        if len(frequencies) > 0
+    ]
+    starts = [task[1] for task in tasks]
+    signal = np.zeros(events[-1][0] + envelope.release, dtype=DTYPE)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start, chord_signal in zip(starts, executor.map(_render_chord_task, tasks)):
+            signal[start:start + len(chord_signal)] += chord_signal
+
+    # Normalization
+    peak = np.max(np.abs(signal))
+    if peak > 1:
+        signal /= peak
+
+    if path is not None:
+        write_wav(path, signal, sample_rate)
+    return signal
+
+def render_events(
+    events: np.ndarray,
+    path: str,
+    blocksize: int = 1024,
+    polyphony: int = 64,
+    envelope: Optional[ADSREnvelope] = None,
+    harmonics: List[float] = p.HARMONICS,
+    waveform: str = p.WAVEFORM,
+    gain: float = p.AMPLITUDE,
+    tuning: str = "equal",
+    reference: float = pitch.REFERENCE_PITCH,
+    skip_drums: bool = True,
+    sample_rate: int = SAMPLE_RATE
+) -> dict:
+    '''
+    Renders a table of note events (see midi.read_midi) with the voice pool of the keyboard
+    and streams it to a wav file block by block, so memory depends on the block size, not on the song.
+
+    Args:
+        events (np.ndarray): midi.EVENT_DTYPE array sorted by sample.
+        path (str): wav file to write.
+        blocksize (int, optional): Frames rendered per block, events are scheduled on their exact
+            sample inside the blocks. Defaults to 1024.
+        polyphony (int, optional): Voices of the pool, the oldest one is stolen beyond. Defaults to 64.
+        gain (float, optional): Gain of a note of velocity 127, the mix is clipped to [-1, 1].
+        tuning (str, optional): Tuning of pitch.midi_to_frequency, as in utils.NOTE_FREQUENCIES.
+        skip_drums (bool, optional): Ignores the General MIDI percussion channel. Defaults to True.
+
+    Returns:
+        dict: frames written, peak level and clipped samples.
+    '''
+    if envelope is None:
+        envelope = ADSREnvelope(p.ATTACK, p.DECAY, p.SUSTAIN, p.RELEASE, sample_rate=sample_rate)
+    if skip_drums:
+        events = events[events["channel"] != DRUM_CHANNEL]
+    pool = VoicePool(polyphony, harmonics, waveform, envelope, sample_rate)
+    engine = AudioGraph(VoicePoolNode(pool))
+    frequencies = pitch.midi_to_frequency(events["note"], reference, tuning).tolist()
+    gains = (gain * events["velocity"] / 127).tolist()
+    # A note-off only releases the note-on of the same note on the same channel of the same track
+    voice_ids = (
+        events["track"].astype(np.int64) << 16 | events["channel"].astype(np.int64) << 8 | events["note"]
+    ).tolist()
+    samples = events["sample"]
+    total = int(samples[-1]) + envelope.release if len(events) > 0 else 0
+
+    block = np.zeros(blocksize, dtype=DTYPE)
+    stats = {"frames": total, "peak": 0.0, "clipped": 0}
+    first = 0
+    with _open_wav(path, sample_rate) as fp:
+        for start in range(0, total, blocksize):
+            last = int(np.searchsorted(samples, start + blocksize, side="left"))
+            for i in range(first, last):
+                if events["kind"][i] == NOTE_ON:
+                    pool.schedule(int(samples[i]), "note_on", frequencies[i], gains[i], None, voice_ids[i])
+                else:
+                    pool.schedule(int(samples[i]), "note_off", frequencies[i], voice_ids[i])
+            first = last
+            out = block[:min(blocksize, total - start)]
+            engine.render_into(out)
+            peak = np.max(np.abs(out))
+            stats["peak"] = max(stats["peak"], float(peak))
+            if peak > 1:
+                stats["clipped"] += int(np.count_nonzero(np.abs(out) > 1))
+            fp.writeframes(_pcm(out))
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "chords",
+        nargs="+",
+        help="Chord symbols, e.g. Gmin F6 Abmaj7, with an optional duration in beats (Gmin:2)"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        default="chords.wav",
+        help="Path of the wav file"
+    )
+    parser.add_argument(
+        "--tempo",
+        type=float,
+        default=120,
+        help="Beats per minute"
+    )
+    parser.add_argument(
+        "--beats",
+        type=float,
+        default=4,
+        help="Duration of each chord in beats"
+    )
+    args = parser.parse_args()
+    render_chord_sequence(" ".join(args.chords), args.output, tempo=args.tempo, beats=args.beats)
@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from utils import DTYPE
+
+
+class RingBuffer():
+    '''
+    Single-producer / single-consumer ring of preallocated blocks.
+    The producer only moves the write counter and the consumer only moves the read counter,
+    a block is filled before its counter is published, so neither side takes a lock.
+    '''
+
+    def __init__(self, num_blocks: int, blocksize: int, dtype=DTYPE):
+        self.num_blocks = num_blocks
+        self.blocksize = blocksize
+        self.blocks = np.zeros((num_blocks, blocksize), dtype=dtype)
+        self._write = 0  # Blocks produced, only updated by the producer
+        self._read = 0  # Blocks consumed, only updated by the consumer
+        self.underruns = 0  # Blocks the consumer needed but were not rendered yet
+
+    def available(self) -> int:
+        return self._write - self._read
+
+    def write_slot(self) -> Optional[np.ndarray]:
+        '''
+        Returns the next block to fill, or None if the ring is full.
+        '''
+        if self._write - self._read >= self.num_blocks:
+            return None
+        return self.blocks[self._write % self.num_blocks]
+
+    def commit(self) -> None:
+        '''
+        Publishes the block returned by write_slot.
+        '''
+        self._write += 1
+
+    def read_into(self, out: np.ndarray) -> bool:
+        '''
+        Copies the oldest block into out, or silence (counted as an underrun) if none is ready.
+        '''
+        if self._write == self._read:
+            out.fill(0)
+            self.underruns += 1
+            return False
+        np.copyto(out, self.blocks[self._read % self.num_blocks])
+        self._read += 1
+        return True
+
+
+class RenderAhead():
+    '''
+    Producer thread keeping a RingBuffer filled with blocks rendered in advance.
+    The depth of the ring trades latency (depth blocks) for robustness under load.
+    '''
+
+    def __init__(
+        self,
+        render_into: Callable[[np.ndarray], None],
+        blocksize: int,
+        depth: int = 2,
+        sample_rate: int = 44100
+    ):
+        self.render_into = render_into
+        self.ring = RingBuffer(depth, blocksize)
+        # Polling period when the ring is full, a fraction of a block
+        self._wait = blocksize / sample_rate / 4
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            slot = self.ring.write_slot()
+            if slot is None:
+                time.sleep(self._wait)
+                continue
+            self.render_into(slot)
+            self.ring.commit()
+
+    def start(self) -> None:
+        '''
+        Starts rendering, the ring is filled before the call returns.
+        '''
+        self._thread.start()
+        while self.ring.available() < self.ring.num_blocks and self._thread.is_alive():
+            time.sleep(self._wait)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def underruns(self) -> int:
+        return self.ring.underruns
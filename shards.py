@@ -0,0 +1,244 @@
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+import numpy as np
+
+import parameters as p
+from envelope import ADSREnvelope
+from utils import DTYPE, SAMPLE_RATE
+from voices import VoicePool
+
+MAX_BLOCKSIZE = 8192  # Largest block a shard can render, sizes its shared buffer
+
+
+def _shard_worker(
+    index, size, harmonics, waveform, envelope, sample_rate, memory_name, num_shards, commands, start, done
+):
+    '''
+    Renders the voices of one shard into its row of the shared block buffer, one block per start signal.
+    Note events received since the previous block are applied first, then the shard moves forward over
+    the blocks it missed while it was late, without rendering them, so that its clock catches up.
+    '''
+    memory = shared_memory.SharedMemory(name=memory_name)
+    blocks, frames, missed, active = _shared_arrays(memory, num_shards)
+    pool = VoicePool(size, harmonics, waveform, envelope, sample_rate)
+    try:
+        while True:
+            start.acquire()
+            while commands.poll():
+                command, *args = commands.recv()
+                if command == "close":
+                    return
+                getattr(pool, command)(*args)
+            pool.advance(int(missed[index]))
+            pool.render_into(blocks[index, :int(frames[index])])
+            active[index] = pool.active
+            done.release()
+    finally:
+        del blocks, frames, missed, active
+        memory.close()
+
+def _shared_arrays(memory: shared_memory.SharedMemory, num_shards: int):
+    '''
+    Views on the shared memory: (shards, MAX_BLOCKSIZE) blocks, then per shard the frames of its block,
+    the frames it missed and its active voices. A shard's slots are only written while it is idle.
+    '''
+    blocks = np.ndarray((num_shards, MAX_BLOCKSIZE), dtype=DTYPE, buffer=memory.buf)
+    counters = np.ndarray((3, num_shards), dtype=np.int64, buffer=memory.buf, offset=blocks.nbytes)
+    return blocks, counters[0], counters[1], counters[2]
+
+
+class ShardedVoicePool():
+    '''
+    Voice pool split in shards, each one rendered by a persistent worker process into a block
+    buffer in shared memory; render_into only signals the workers and sums their blocks.
+    Rendering scales with the number of cores instead of being bound to the GIL of the audio thread.
+
+    It has the interface of VoicePool (note_on, note_off, all_notes_off, schedule, reset_clock, prepare,
+    render_into), so it can replace it in a graph.VoicePoolNode. The wait per block is bounded by timeout,
+    counted from the start of render_into. It runs in the audio callback, so by default it is only
+    p.MAX_UTILIZATION of the block duration: the rest of the deadline is left for the mix, the copy and
+    the rest of the callback, which would underrun if a late shard used all of it.
+    A shard that has not finished by then is left out of the block (late_blocks) and its block is dropped.
+    Blocks starting while a shard is still late are not signalled to it (missed_blocks); the shard
+    skips their frames with VoicePool.advance before its next block, so its voices and its event clock
+    stay aligned with the pool clock instead of drifting behind it, without any extra rendering.
+    '''
+
+    def __init__(
+        self,
+        size: int = p.POLYPHONY,
+        harmonics: List[float] = p.HARMONICS,
+        waveform: str = p.WAVEFORM,
+        envelope: Optional[ADSREnvelope] = None,
+        sample_rate: int = SAMPLE_RATE,
+        workers: int = 2,
+        timeout: Optional[float] = None
+    ):
+        '''
+        size voices are split evenly between workers processes, timeout (in seconds) defaults to
+        p.MAX_UTILIZATION of the duration of a block.
+        '''
+        self.size = size
+        self.sample_rate = sample_rate
+        self.timeout = timeout
+        self.workers = workers
+        self.late_blocks = 0  # Shard blocks left out of the mix because they missed the deadline
+        self.missed_blocks = 0  # Shard blocks not started because the shard was still late, caught up later
+
+        blocks_size = workers * MAX_BLOCKSIZE * DTYPE.itemsize
+        self.memory = shared_memory.SharedMemory(create=True, size=blocks_size + 8 * 3 * workers)
+        self.blocks, self.frames, self.missed, self.active_voices = _shared_arrays(self.memory, workers)
+        self.blocks.fill(0)
+        self.frames.fill(0)
+        self.missed.fill(0)
+        self.active_voices.fill(0)
+        self._weights = np.zeros(workers, dtype=DTYPE)  # 1 for the shards mixed in the block
+        self._mix = {}  # Mix buffers, by block size
+        self._pending = np.zeros(workers, dtype=bool)  # Shards still rendering a block
+        self._started = np.zeros(workers, dtype=bool)  # Shards rendering the current block
+        self._missed_frames = np.zeros(workers, dtype=np.int64)  # Frames to catch up, by shard
+
+        self.commands = []
+        self.starts = []
+        self.dones = []
+        self.processes = []
+        shard_sizes = np.diff(np.linspace(0, size, workers + 1).astype(int))
+        for index, shard_size in enumerate(shard_sizes):
+            receiver, sender = mp.Pipe(duplex=False)
+            start, done = mp.Semaphore(0), mp.Semaphore(0)
+            process = mp.Process(
+                target=_shard_worker,
+                args=(index, int(shard_size), harmonics, waveform, envelope, sample_rate,
+                      self.memory.name, workers, receiver, start, done),
+                daemon=True
+            )
+            process.start()
+            self.commands.append(sender)
+            self.starts.append(start)
+            self.dones.append(done)
+            self.processes.append(process)
+        self._next_shard = 0
+        self.sample = 0  # Samples rendered, the clock of schedule
+
+    @property
+    def active(self) -> int:
+        '''
+        Voices playing at the end of the last block.
+        '''
+        return int(self.active_voices.sum())
+
+    def note_on(
+        self,
+        frequency: float,
+        gain: float = p.AMPLITUDE,
+        duration: Optional[float] = None,
+        voice_id: int = -1
+    ) -> None:
+        '''
+        Starts the note on the least busy shard, in turn among equally busy ones.
+        '''
+        self.commands[self._pick_shard()].send(("note_on", frequency, gain, duration, voice_id))
+
+    def _pick_shard(self) -> int:
+        order = np.roll(np.arange(self.workers), -self._next_shard)
+        shard = int(order[np.argmin(self.active_voices[order])])
+        self._next_shard = (shard + 1) % self.workers
+        # Counted now so that notes started before the next block spread over the shards
+        self.active_voices[shard] += 1
+        return shard
+
+    def note_off(self, frequency: float, voice_id: int = -1) -> None:
+        for commands in self.commands:
+            commands.send(("note_off", frequency, voice_id))
+
+    def all_notes_off(self) -> None:
+        for commands in self.commands:
+            commands.send(("all_notes_off",))
+
+    def schedule(self, sample: int, event: str, *args) -> None:
+        '''
+        Schedules an event of VoicePool.schedule, note-ons go to one shard and other events to all of them.
+        '''
+        if event not in VoicePool.EVENTS:
+            raise ValueError(f"Unsupported event. Choose among {', '.join(VoicePool.EVENTS)}.")
+        shards = [self._pick_shard()] if event == "note_on" else range(self.workers)
+        for shard in shards:
+            self.commands[shard].send(("schedule", sample, event, *args))
+
+    def reset_clock(self) -> None:
+        '''
+        Restarts the clock at 0, the shards reset theirs before rendering the next block.
+        Late shards are waited for first, so it should not be called from the audio thread;
+        frames missed before the reset are not caught up, they are before the new clock.
+        '''
+        for index, done in enumerate(self.dones):
+            if self._pending[index]:
+                done.acquire()
+                self._pending[index] = False
+        for commands in self.commands:
+            commands.send(("reset_clock",))
+        self._missed_frames.fill(0)
+        self.sample = 0
+
+    def prepare(self, frames: int) -> np.ndarray:
+        if frames > MAX_BLOCKSIZE:
+            raise ValueError(f"Blocks are limited to {MAX_BLOCKSIZE} frames.")
+        mix = self._mix.get(frames)
+        if mix is None:
+            mix = np.zeros(frames, dtype=DTYPE)
+            self._mix[frames] = mix
+        return mix
+
+    def render_into(self, out: np.ndarray) -> None:
+        deadline = time.perf_counter()
+        deadline += p.MAX_UTILIZATION * len(out) / self.sample_rate if self.timeout is None else self.timeout
+        frames = len(out)
+        mix = self.prepare(frames)
+        for index, start in enumerate(self.starts):
+            # The late block of a shard that has finished since is dropped, it was left out of its own block
+            if self._pending[index] and self.dones[index].acquire(block=False):
+                self._pending[index] = False
+            self._started[index] = not self._pending[index]
+            if self._pending[index]:
+                self._missed_frames[index] += frames
+                self.missed_blocks += 1
+                continue
+            # Slots of an idle shard, it reads them once started
+            self.frames[index] = frames
+            self.missed[index] = self._missed_frames[index]
+            self._missed_frames[index] = 0
+            start.release()
+            self._pending[index] = True
+
+        for index, done in enumerate(self.dones):
+            if not self._started[index]:
+                continue
+            if done.acquire(timeout=max(deadline - time.perf_counter(), 0)):
+                self._pending[index] = False
+            else:
+                self.late_blocks += 1
+
+        # Only the shards that rendered this block are mixed, late ones still own their row
+        np.greater(self._started, self._pending, out=self._started)
+        np.copyto(self._weights, self._started)
+        np.matmul(self._weights, self.blocks[:, :frames], out=mix)
+        np.copyto(out, mix)
+        self.sample += frames
+
+    def render(self, frames: int) -> np.ndarray:
+        signal = np.empty(frames, dtype=DTYPE)
+        self.render_into(signal)
+        return signal
+
+    def close(self) -> None:
+        for commands, start in zip(self.commands, self.starts):
+            commands.send(("close",))
+            start.release()
+        for process in self.processes:
+            process.join(timeout=1)
+        del self.blocks, self.frames, self.active_voices
+        self.memory.close()
+        self.memory.unlink()
@@ -0,0 +1,164 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from utils import SAMPLE_RATE
+
+# PortAudio flags of the status argument of a sounddevice callback
+STATUS_FLAGS = ("input_underflow", "input_overflow", "output_underflow", "output_overflow")
+
+
+class CallbackTelemetry():
+    '''
+    Render time and status flags of an audio callback, recorded from the audio thread.
+    Render times go into a fixed-size histogram of deadline utilization (render time divided
+    by the duration of a block), in bins of 1 / bins_per_deadline up to max_utilization,
+    the last bin counting everything slower. Recording only updates preallocated counters.
+    '''
+
+    def __init__(
+        self,
+        blocksize: int,
+        sample_rate: int = SAMPLE_RATE,
+        bins_per_deadline: int = 50,
+        max_utilization: float = 2.0
+    ):
+        self.deadline = blocksize / sample_rate
+        self.bins_per_deadline = bins_per_deadline
+        self.histogram = np.zeros(int(bins_per_deadline * max_utilization) + 1, dtype=np.int64)
+        self.flags = np.zeros(len(STATUS_FLAGS), dtype=np.int64)
+        self.reset()
+        self._logger = None
+        self._stop_logging = threading.Event()
+
+    def reset(self) -> None:
+        self.histogram.fill(0)
+        self.flags.fill(0)
+        self.callbacks = 0
+        self.total_time = 0.0
+        self.peak_time = 0.0
+
+    @staticmethod
+    def begin() -> float:
+        '''
+        Timestamp to pass to end, taken at the start of the callback.
+        '''
+        return time.perf_counter()
+
+    def end(self, start: float, status=None) -> None:
+        '''
+        Records the callback that started at start, and the flags of its status argument.
+        '''
+        elapsed = time.perf_counter() - start
+        self.callbacks += 1
+        self.total_time += elapsed
+        if elapsed > self.peak_time:
+            self.peak_time = elapsed
+        self.histogram[min(int(elapsed / self.deadline * self.bins_per_deadline), len(self.histogram) - 1)] += 1
+        if status:
+            for i, flag in enumerate(STATUS_FLAGS):
+                if getattr(status, flag, False):
+                    self.flags[i] += 1
+
+    def percentile(self, q: float) -> float:
+        '''
+        Deadline utilization below which q percent of the callbacks fall, up to a bin width.
+        '''
+        if self.callbacks == 0:
+            return 0.0
+        counts = np.cumsum(self.histogram)
+        index = int(np.searchsorted(counts, q / 100 * counts[-1]))
+        return (index + 1) / self.bins_per_deadline
+
+    def snapshot(self) -> Dict[str, float]:
+        '''
+        Summary of the callbacks recorded so far, utilizations are fractions of the deadline.
+        '''
+        callbacks = max(self.callbacks, 1)
+        snapshot = {
+            "callbacks": self.callbacks,
+            "deadline": self.deadline,
+            "mean_time": self.total_time / callbacks,
+            "peak_time": self.peak_time,
+            "mean_utilization": self.total_time / callbacks / self.deadline,
+            "peak_utilization": self.peak_time / self.deadline,
+            "p50_utilization": self.percentile(50),
+            "p99_utilization": self.percentile(99),
+            "late_callbacks": int(self.histogram[self.bins_per_deadline:].sum()),
+        }
+        for flag, count in zip(STATUS_FLAGS, self.flags):
+            snapshot[flag] = int(count)
+        return snapshot
+
+    def log_line(self) -> str:
+        s = self.snapshot()
+        return (
+            f"callbacks {s['callbacks']} | deadline {1e3 * s['deadline']:.1f} ms | "
+            f"mean {100 * s['mean_utilization']:.1f} % p99 {100 * s['p99_utilization']:.0f} % "
+            f"peak {100 * s['peak_utilization']:.1f} % ({1e3 * s['peak_time']:.2f} ms) | "
+            f"late {s['late_callbacks']} | underflows {s['output_underflow']} overflows {s['output_overflow']}"
+        )
+
+    def start_logging(self, interval: float = 5.0, log: Callable[[str], None] = print) -> None:
+        '''
+        Logs a summary line every interval seconds from a background thread, never from the audio thread.
+        '''
+        if self._logger is not None:
+            return
+        self._stop_logging.clear()
+
+        def run():
+            while not self._stop_logging.wait(interval):
+                log(self.log_line())
+
+        self._logger = threading.Thread(target=run, daemon=True)
+        self._logger.start()
+
+    def stop_logging(self, timeout: Optional[float] = None) -> None:
+        if self._logger is None:
+            return
+        self._stop_logging.set()
+        self._logger.join(timeout)
+        self._logger = None
+
+
+class KeyLatency():
+    '''
+    Key-to-sound latency: time from a key press to the callback of the block its note starts in,
+    plus the offset of the note in that block and the time the block waits before reaching the DAC.
+    The last size measures are kept in a preallocated ring.
+    '''
+
+    def __init__(self, size: int = 64, sample_rate: int = SAMPLE_RATE):
+        self.latencies = np.zeros(size)
+        self.count = 0
+        self.sample_rate = sample_rate
+        self._pressed = None
+        self._sample = 0
+
+    def press(self, sample: int) -> None:
+        '''
+        sample is the sample of the stream clock the note of the key was scheduled on.
+        '''
+        self._pressed = time.perf_counter()
+        self._sample = sample
+
+    def rendered(self, block_start: int, frames: int, output_delay: float) -> None:
+        '''
+        Called by the audio callback for the block of frames from block_start, output_delay is the
+        time until this block is played. The measure is taken in the block of the pressed note.
+        '''
+        if self._pressed is None or block_start + frames <= self._sample:
+            return
+        offset = max(self._sample - block_start, 0) / self.sample_rate
+        self.latencies[self.count % len(self.latencies)] = time.perf_counter() - self._pressed + offset + output_delay
+        self._pressed = None
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        latencies = self.latencies[:min(self.count, len(self.latencies))]
+        if len(latencies) == 0:
+            return {"notes": 0, "mean": 0.0, "max": 0.0}
+        return {"notes": self.count, "mean": float(latencies.mean()), "max": float(latencies.max())}
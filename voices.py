@@ -0,0 +1,402 @@
+import heapq
+import threading
+from typing import Optional, List
+
+import numpy as np
+
+import parameters as p
+from envelope import ADSREnvelope
+from utils import DTYPE, SAMPLE_RATE
+
+NO_RELEASE = 2 ** 40  # Release position of a voice that has not been released
+
+
+class VoicePool():
+    '''
+    Fixed-size pool of voices stored as a struct of arrays.
+    Active voices are kept packed at the front of the arrays, so a block is rendered
+    for every sounding note at once with a single batched computation.
+    When all the voices are busy, the oldest one is stolen.
+
+    Events can also be scheduled at a sample of the pool clock (samples rendered so far): a block is
+    then rendered in segments split at the events, which take effect on their exact sample.
+    '''
+
+    # Methods that can be scheduled with schedule
+    EVENTS = ("note_on", "note_off", "all_notes_off", "set_gain")
+
+    def __init__(
+        self,
+        size: int = p.POLYPHONY,
+        harmonics: List[float] = p.HARMONICS,
+        waveform: str = p.WAVEFORM,
+        envelope: Optional[ADSREnvelope] = None,
+        sample_rate: int = SAMPLE_RATE
+    ):
+        if waveform not in ("sinus", "sawtooth", "square", "triangle"):
+            raise ValueError("Unsupported wave type. Choose among 'sinus', 'sawtooth', 'square' or 'triangle'.")
+        self.size = size
+        self.waveform = waveform
+        self.sample_rate = sample_rate
+
+        # Harmonics are normalized once so that a voice never exceeds 1 in amplitude
+        self.harmonics = np.asarray(harmonics, dtype=float)
+        self.harmonics /= np.sum(np.abs(self.harmonics))
+        self._angular_orders = 2 * np.pi * np.arange(1, len(self.harmonics) + 1)
+
+        # The envelope settings are shared by all voices, its state is stored per voice below
+        self.envelope = envelope
+
+        # Voice state
+        self.frequencies = np.zeros(size)
+        self.phases = np.zeros((size, len(self.harmonics)))
+        self.envelope_positions = np.zeros(size, dtype=int)
+        self.release_positions = np.full(size, NO_RELEASE, dtype=int)
+        self.release_levels = np.zeros((size, 1, 1), dtype=DTYPE)
+        self.gains = np.zeros(size)
+        self.ages = np.zeros(size, dtype=int)  # Note-on order, used for voice stealing
+        self.voice_ids = np.full(size, -1, dtype=np.int64)  # Ids given at note-on, -1 without
+        self.active = 0  # Number of active voices
+        self._note_counter = 0
+        self.sample = 0  # Samples rendered since the pool was created
+        self.events = []  # Heap of (sample, order, method, args) scheduled events
+        self._event_counter = 0
+
+        self.lock = threading.Lock()  # Voices are updated from the input thread
+        self._buffers = {}  # Scratch buffers of render_into, by block size
+
+    def note_on(
+        self,
+        frequency: float,
+        gain: float = p.AMPLITUDE,
+        duration: Optional[float] = None,
+        voice_id: int = -1
+    ) -> None:
+        '''
+        Starts a new voice, stealing the oldest one if the pool is full.
+        If a duration is given, the release is scheduled so that the note fades out by then.
+        A voice_id lets note_off release this note only, e.g. one MIDI note of one channel.
+        '''
+        with self.lock:
+            self._note_on(frequency, gain, duration, voice_id)
+
+    def _note_on(
+        self,
+        frequency: float,
+        gain: float = p.AMPLITUDE,
+        duration: Optional[float] = None,
+        voice_id: int = -1
+    ) -> None:
+        if self.active < self.size:
+            idx = self.active
+            self.active += 1
+        else:
+            idx = int(np.argmin(self.ages))
+        self._note_counter += 1
+        self.frequencies[idx] = frequency
+        self.phases[idx] = 0.0
+        self.envelope_positions[idx] = 0
+        self.release_positions[idx] = NO_RELEASE
+        self.gains[idx] = gain
+        self.ages[idx] = self._note_counter
+        self.voice_ids[idx] = voice_id
+        if duration is not None and self.envelope is not None:
+            release = int(duration * self.sample_rate) - self.envelope.release
+            self._schedule_release(idx, max(release, 0))
+
+    def note_off(self, frequency: float, voice_id: int = -1) -> None:
+        '''
+        Releases every voice playing the given frequency, or only the ones started with voice_id
+        if it is given. They are freed once faded out.
+        '''
+        with self.lock:
+            self._note_off(frequency, voice_id)
+
+    def _note_off(self, frequency: float, voice_id: int = -1) -> None:
+        for idx in reversed(range(self.active)):
+            if self.frequencies[idx] != frequency or (voice_id != -1 and self.voice_ids[idx] != voice_id):
+                continue
+            if self.envelope is None:
+                self._free(idx)
+            elif self.release_positions[idx] > self.envelope_positions[idx]:
+                self._schedule_release(idx, self.envelope_positions[idx])
+
+    def _schedule_release(self, idx: int, position: int) -> None:
+        self.release_positions[idx] = position
+        self.release_levels[idx] = self.envelope.level_at(position)
+
+    def all_notes_off(self) -> None:
+        with self.lock:
+            self._all_notes_off()
+
+    def _all_notes_off(self) -> None:
+        self.active = 0
+
+    def set_gain(self, frequency: float, gain: float) -> None:
+        '''
+        Changes the gain of every voice playing the given frequency.
+        '''
+        with self.lock:
+            self._set_gain(frequency, gain)
+
+    def _set_gain(self, frequency: float, gain: float) -> None:
+        self.gains[:self.active][self.frequencies[:self.active] == frequency] = gain
+
+    def schedule(self, sample: int, event: str, *args) -> None:
+        '''
+        Schedules one of EVENTS (e.g. "note_on", frequency) at a sample of the pool clock.
+        Events in the past take effect at the start of the next block.
+        '''
+        if event not in self.EVENTS:
+            raise ValueError(f"Unsupported event. Choose among {', '.join(self.EVENTS)}.")
+        with self.lock:
+            self._event_counter += 1
+            heapq.heappush(self.events, (sample, self._event_counter, event, args))
+
+    def reset_clock(self) -> None:
+        '''
+        Restarts the pool clock at 0 and drops the scheduled events, e.g. once blocks have been
+        rendered before the stream starts.
+        '''
+        with self.lock:
+            self.sample = 0
+            self.events.clear()
+
+    def _free(self, idx: int) -> None:
+        '''
+        Frees a voice by moving the last active voice in its slot (lock must be held).
+        '''
+        last = self.active - 1
+        if idx != last:
+            self.frequencies[idx] = self.frequencies[last]
+            self.phases[idx] = self.phases[last]
+            self.envelope_positions[idx] = self.envelope_positions[last]
+            self.release_positions[idx] = self.release_positions[last]
+            self.release_levels[idx] = self.release_levels[last]
+            self.gains[idx] = self.gains[last]
+            self.ages[idx] = self.ages[last]
+            self.voice_ids[idx] = self.voice_ids[last]
+        self.active = last
+
+    def prepare(self, frames: int) -> "RenderBuffers":
+        '''
+        Returns the scratch buffers for this block size, allocating them on first use.
+        Call it before starting the stream so that the audio thread never allocates.
+        '''
+        buffers = self._buffers.get(frames)
+        if buffers is None:
+            buffers = RenderBuffers(self.size, len(self.harmonics), frames, self.sample_rate)
+            self._buffers[frames] = buffers
+        return buffers
+
+    def render(self, frames: int) -> np.ndarray:
+        '''
+        Renders and mixes all the active voices for one block.
+        Phases and envelope positions are updated for the next block.
+        '''
+        signal = np.empty(frames, dtype=DTYPE)
+        self.render_into(signal)
+        return signal
+
+    def render_into(self, out: np.ndarray) -> None:
+        '''
+        Real-time version of render, writing the mix of one block straight into out
+        (e.g. the float32 outdata of the stream).
+        Every intermediate result goes into the preallocated buffers of the block size,
+        so no array is allocated once prepare has been called for that size.
+        The block is split at the scheduled events that fall in it, each segment being rendered
+        in one batched pass into views of the same buffers.
+        '''
+        frames = len(out)
+        buffers = self.prepare(frames)
+
+        with self.lock:
+            end = self.sample + frames
+            offset = 0
+            while self.events and self.events[0][0] < end:
+                sample, _, event, args = heapq.heappop(self.events)
+                split = max(sample - self.sample, offset)
+                if split > offset:
+                    self._render_segment(out[offset:split], buffers.view(split - offset))
+                    offset = split
+                getattr(self, "_" + event)(*args)
+            if offset == 0:
+                self._render_segment(out, buffers)
+            elif offset < frames:
+                self._render_segment(out[offset:], buffers.view(frames - offset))
+            self.sample = end
+
+    def _render_segment(self, out: np.ndarray, buffers: "RenderBuffers") -> None:
+        '''
+        Renders and mixes the active voices into out, buffers having the length of out (lock must be held).
+        '''
+        frames = len(out)
+        n = self.active
+        if n == 0:
+            out.fill(0)
+            return
+
+        # Broadcasts go through matmul, elementwise ufuncs would allocate iteration buffers
+        # Each row of coefficients is (angular frequency, phase) of one harmonic of one voice
+        coefficients = buffers.coefficients[:n]
+        omega = coefficients[:, :, 0]
+        phases = self.phases[:n]
+        np.multiply(self.frequencies[:n, None], self._angular_orders, out=omega)
+        coefficients[:, :, 1] = phases
+
+        # Harmonic weights of each voice, including its gain
+        weights = buffers.weights[:n]
+        np.multiply(self.gains[:n, None], self.harmonics, out=weights[:, 0, :])
+        tones = buffers.tones[:n]
+
+        if self.waveform == "sinus":
+            # Shape (voices, harmonics, frames), summed over harmonics
+            waves = buffers.waves[:n]
+            np.matmul(coefficients, buffers.time, out=waves)
+            np.sin(waves, out=waves)
+            np.matmul(weights, waves, out=tones)
+        else:
+            waves = buffers.shape[:n]
+            np.matmul(coefficients[:, :1], buffers.time, out=waves)
+            if self.waveform == "sawtooth":
+                floor = tones
+                np.divide(waves, 2 * np.pi, out=waves)
+                np.add(waves, 0.5, out=floor)
+                np.floor(floor, out=floor)
+                np.subtract(waves, floor, out=waves)
+                np.multiply(waves, 2, out=waves)
+            elif self.waveform == "triangle":
+                # Same phase as a sine, as in synthesis.generate_tone: 1 - 4 |(cycles + 1/4) mod 1 - 1/2|
+                np.divide(waves, 2 * np.pi, out=waves)
+                np.add(waves, 0.25, out=waves)
+                np.mod(waves, 1.0, out=waves)
+                np.subtract(waves, 0.5, out=waves)
+                np.abs(waves, out=waves)
+                np.multiply(waves, -4, out=waves)
+                np.add(waves, 1, out=waves)
+            else:
+                np.sin(waves, out=waves)
+                np.sign(waves, out=waves)
+            np.matmul(self.gains[:n, None, None], waves, out=tones)
+        # Phases need float64, the rest of the block is in the sample type
+        signal = buffers.signal[:n]
+        np.copyto(signal, tones[:, 0, :])
+
+        if self.envelope is not None:
+            # Samples since note-on and since note-off of each voice over the block
+            starts = buffers.envelope_starts[:n]
+            starts[:, 0] = self.envelope_positions[:n]
+            positions = buffers.envelope_positions[:n]
+            np.matmul(starts, buffers.ramp, out=positions)
+            np.subtract(self.envelope_positions[:n], self.release_positions[:n], out=starts[:, 0])
+            release_offsets = buffers.release_offsets[:n]
+            np.matmul(starts, buffers.ramp, out=release_offsets)
+
+            envelope = buffers.envelope[:n]
+            self.envelope.evaluate_into(
+                positions,
+                release_offsets,
+                self.release_levels[:n],
+                envelope,
+                buffers.envelope_scratch[:n],
+                buffers.released[:n]
+            )
+            np.multiply(signal, envelope, out=signal)
+            self.envelope_positions[:n] += frames
+
+        # Keep track of the phases to start the next block where this one ended
+        np.multiply(omega, frames / self.sample_rate, out=omega)
+        np.add(phases, omega, out=phases)
+        np.mod(phases, 2 * np.pi, out=phases)
+
+        np.matmul(buffers.ones[:n], signal, out=buffers.mix)
+        np.copyto(out, buffers.mix)
+        self._free_finished()
+
+    def _free_finished(self) -> None:
+        '''
+        Frees the voices whose envelope has faded out (lock must be held).
+        '''
+        if self.envelope is None:
+            return
+        for idx in range(self.active - 1, -1, -1):
+            release = self.release_positions[idx]
+            if self.envelope.is_finished(
+                self.envelope_positions[idx],
+                None if release == NO_RELEASE else release
+            ):
+                self._free(idx)
+
+    def advance(self, frames: int) -> None:
+        '''
+        Moves the voices and the clock frames samples forward without rendering them, applying the
+        scheduled events in between, e.g. to catch up with blocks that were dropped.
+        '''
+        with self.lock:
+            end = self.sample + frames
+            while self.events and self.events[0][0] < end:
+                sample, _, event, args = heapq.heappop(self.events)
+                self._advance_voices(sample - self.sample)
+                getattr(self, "_" + event)(*args)
+            self._advance_voices(end - self.sample)
+
+    def _advance_voices(self, frames: int) -> None:
+        if frames <= 0:
+            return
+        n = self.active
+        self.phases[:n] += self.frequencies[:n, None] * self._angular_orders * (frames / self.sample_rate)
+        self.phases[:n] %= 2 * np.pi
+        if self.envelope is not None:
+            self.envelope_positions[:n] += frames
+            self._free_finished()
+        self.sample += frames
+
+
+class RenderBuffers():
+    '''
+    Scratch buffers used by VoicePool.render_into for one block size.
+    Phase computations are in float64, envelopes and mixes in utils.DTYPE.
+    '''
+
+    def __init__(self, size: int, num_harmonics: int, frames: int, sample_rate: int = SAMPLE_RATE):
+        # Time basis: (omega, phase) @ time gives omega * t + phase
+        self.time = np.vstack((np.arange(frames) / sample_rate, np.ones(frames)))
+        # Envelope basis: (position, 1) @ ramp gives position + n
+        self.ramp = np.vstack((np.ones(frames, dtype=DTYPE), np.arange(frames, dtype=DTYPE)))
+        self.coefficients = np.zeros((size, num_harmonics, 2))
+        self.weights = np.zeros((size, 1, num_harmonics))
+        self.envelope_starts = np.ones((size, 2), dtype=DTYPE)
+        self.ones = np.ones(size, dtype=DTYPE)
+        self.waves = np.zeros((size, num_harmonics, frames))
+        self.shape = np.zeros((size, 1, frames))  # Sawtooth, square and triangle waves
+        self.tones = np.zeros((size, 1, frames))  # Voices before the envelope, in float64
+        self.signal = np.zeros((size, frames), dtype=DTYPE)
+        self.envelope_positions = np.zeros((size, frames), dtype=DTYPE)
+        self.release_offsets = np.zeros((size, frames), dtype=DTYPE)
+        self.envelope = np.zeros((size, frames), dtype=DTYPE)
+        self.envelope_scratch = np.zeros((size, frames), dtype=DTYPE)
+        self.released = np.zeros((size, frames), dtype=bool)
+        self.mix = np.zeros(frames, dtype=DTYPE)
+        self.frames = frames
+
+    def view(self, frames: int) -> "RenderBuffers":
+        '''
+        Buffers for a shorter segment of the block: contiguous views over the start of these ones,
+        so that splitting a block allocates no array.
+        '''
+        if frames == self.frames:
+            return self
+        segment = RenderBuffers.__new__(RenderBuffers)
+        segment.__dict__.update(self.__dict__)
+        segment.frames = frames
+        segment.time = self.time[:, :frames]
+        segment.ramp = self.ramp[:, :frames]
+        segment.mix = self.mix[:frames]
+        for name in (
+            "waves", "shape", "tones", "signal", "envelope_positions", "release_offsets", "envelope",
+            "envelope_scratch", "released"
+        ):
+            array = getattr(self, name)
+            shape = array.shape[:-1] + (frames,)
+            setattr(segment, name, array.reshape(-1)[:int(np.prod(shape))].reshape(shape))
+        return segment
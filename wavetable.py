@@ -0,0 +1,120 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils import DTYPE
+
+TABLE_SIZE = 2048  # Samples in one cycle of a table
+LOWEST_FREQUENCY = 20  # Fundamental frequency covered by the richest table (in Hz)
+
+
+class Wavetable():
+    '''
+    Mip-mapped single-cycle tables of a waveform.
+    Each level is band-limited for one octave of fundamental frequencies: level l holds
+    only the partials that stay below Nyquist up to LOWEST_FREQUENCY * 2**(l+1).
+    '''
+
+    def __init__(self, partials: np.ndarray, sample_rate: int = 44100):
+        '''
+        partials (np.ndarray): amplitude of the sine partial k+1 at index k.
+        '''
+        self.sample_rate = sample_rate
+        nyquist = sample_rate / 2
+        num_levels = max(1, int(np.ceil(np.log2(nyquist / LOWEST_FREQUENCY))))
+        orders = np.arange(1, len(partials) + 1)
+
+        # An extra guard point at the end of each table avoids wrapping during interpolation
+        self.tables = np.zeros((num_levels, TABLE_SIZE + 1), dtype=DTYPE)
+        for level in range(num_levels):
+            top_frequency = LOWEST_FREQUENCY * 2 ** (level + 1)
+            kept = np.where(orders * top_frequency <= nyquist, partials, 0.0)
+            spectrum = np.zeros(TABLE_SIZE // 2 + 1, dtype=complex)
+            n = min(len(kept), TABLE_SIZE // 2 - 1)
+            # A sine of amplitude a is a purely imaginary bin of -a * N / 2
+            spectrum[1:n + 1] = -1j * kept[:n] * TABLE_SIZE / 2
+            table = np.fft.irfft(spectrum, TABLE_SIZE)
+            self.tables[level, :-1] = table
+            self.tables[level, -1] = table[0]
+
+    def level(self, frequency: np.ndarray) -> np.ndarray:
+        '''
+        Returns the index of the richest table that does not alias at each frequency.
+        '''
+        frequency = np.maximum(frequency, LOWEST_FREQUENCY)
+        level = np.ceil(np.log2(frequency / LOWEST_FREQUENCY)).astype(int) - 1
+        return np.clip(level, 0, len(self.tables) - 1)
+
+    def render(self, frequencies: np.ndarray, frames: int, initial_phases: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Reads the tables with a phase accumulator and linear interpolation, one row per frequency.
+        Phases are in radians, the final ones are the phases of the fundamentals after the block.
+        The phase accumulator is in float64, the tables and the signal in utils.DTYPE.
+        '''
+        frequencies = np.asarray(frequencies, dtype=float)
+        initial_phases = np.asarray(initial_phases, dtype=float)
+        levels = self.level(frequencies)[:, None]
+        increments = frequencies / self.sample_rate
+        cycles = (initial_phases[:, None] / (2 * np.pi) + increments[:, None] * np.arange(frames)) % 1.0
+        position = cycles * TABLE_SIZE
+        index = position.astype(int)
+        fraction = np.subtract(position, index, out=np.empty(position.shape, dtype=DTYPE))
+        left = self.tables[levels, index]
+        signal = left + fraction * (self.tables[levels, index + 1] - left)
+
+        final_phases = (initial_phases + 2 * np.pi * increments * frames) % (2 * np.pi)
+        return signal, final_phases
+
+
+# Tables are computed on first use and shared by every caller
+_wavetables: Dict[Tuple[str, Tuple[float, ...], int], Wavetable] = {}
+
+def waveform_partials(waveform: str, harmonics: List[float], num_partials: int = TABLE_SIZE // 2 - 1) -> np.ndarray:
+    '''
+    Sine partial amplitudes of the waveforms generated by synthesis.generate_tone.
+    Harmonic coefficients only apply to the sinus waveform, as in generate_tone.
+    '''
+    orders = np.arange(1, num_partials + 1)
+    if waveform == "sinus":
+        partials = np.zeros(num_partials)
+        partials[:len(harmonics)] = harmonics
+    elif waveform == "sawtooth":
+        partials = (2 / np.pi) * (-1.0) ** (orders + 1) / orders
+    elif waveform == "square":
+        partials = np.where(orders % 2 == 1, 4 / (np.pi * orders), 0.0)
+    elif waveform == "triangle":
+        partials = np.where(orders % 2 == 1, 8 / np.pi ** 2 * (-1.0) ** ((orders - 1) // 2) / orders ** 2, 0.0)
+    else:
+        raise ValueError("Unsupported wave type. Choose among 'sinus', 'sawtooth', 'square' or 'triangle'.")
+    return partials
+
+def get_wavetable(waveform: str, harmonics: List[float], sample_rate: int = 44100) -> Wavetable:
+    key = (waveform, tuple(harmonics), sample_rate)
+    if key not in _wavetables:
+        _wavetables[key] = Wavetable(waveform_partials(waveform, harmonics), sample_rate)
+    return _wavetables[key]
+
+def render_wavetable(
+    frequencies: np.ndarray,
+    frames: int,
+    sample_rate: int = 44100,
+    initial_phases: Optional[np.ndarray] = None,
+    waveform: str = "sinus",
+    harmonics: List[float] = [1.0]
+) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Wavetable counterpart of the oscillator in synthesis.generate_tone.
+    frequencies has shape (voices,) and initial_phases (voices, harmonics).
+    Harmonics are read phase-locked to the fundamental, which starts at initial_phases[:, 0].
+    Returns the (voices, frames) signal and the final phase of each harmonic, as generate_tone does.
+    '''
+    frequencies = np.asarray(frequencies, dtype=float)
+    if initial_phases is None:
+        initial_phases = np.zeros((len(frequencies), len(harmonics)))
+    wavetable = get_wavetable(waveform, harmonics, sample_rate)
+    signal, _ = wavetable.render(frequencies, frames, initial_phases[:, 0])
+
+    # Same phase bookkeeping as the direct oscillator
+    omega = 2 * np.pi * frequencies[:, None] * np.arange(1, initial_phases.shape[1] + 1)
+    final_phases = (omega * frames / sample_rate + initial_phases) % (2 * np.pi)
+    return signal, final_phases